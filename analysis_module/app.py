@@ -1,12 +1,18 @@
-from flask import Flask, request
+from flask import Flask, Response, request, make_response
 from flask_cors import CORS
-import json
-from modality import Modality
-from producer import Producer
-from datetime import datetime, timedelta
-from further_handlers import handle_expression, find_spikes
-import pandas as pd
-import sched, time
+from codec import (
+    MSGPACK_MIMETYPE,
+    NDJSON_MIMETYPE,
+    decode_body,
+    msgpack_samples,
+    ndjson_samples,
+)
+from events import EventBroker
+from metrics import PROMETHEUS_MIMETYPE
+from mqtt_ingest import MqttIngest
+from pipeline import load_config
+from sessions import DEFAULT_SESSION, LocalSessions, SessionNotFound, ShardedSessions
+import os
 import requests
 import time
 import logging
@@ -14,106 +20,54 @@ import logging
 log = logging.getLogger("werkzeug")
 log.setLevel(logging.ERROR)
 
-ANALYSIS_INTERVAL = 0.1  # seconds
+DEBUG = True
 ROBOT_CONTROLLER_URL = "http://robot-controller:5000"
 LINKEDIN_ROUTE = "http://linkedin-scraping:5000/linkedInScore"
 EXPRESSION_ANALYZER_BASE_URL = "http://expression-processor:5000"
 
 USE_LINKEDIN = False # Ob das Tool LinkedIn nutzen soll für die Initialisierung oder nicht
 
-PRODUCERS = [
-    Producer(
-        "pupil",
-        analysis_interval=0.5,
-        threshold=0.001,
-        handler="_handle_trend",
-        output_modalities={"speed": 1.0, "smoothness": 1.0, "rotation": 1.0},
-    ),
-    Producer(
-        "operator/distance",
-        analysis_interval=1,
-        threshold=5,
-        handler="_handle_trend",
-        output_modalities={"speed": 1.2, "proxemics": 1.2},
-    ),
-    Producer(
-        "expression",
-        analysis_interval=3,
-        threshold=-2,
-        handler=handle_expression,
-        output_modalities={"episodic_behaviour": 1.0},
-    ),
-    Producer(
-        "heartrate",
-        analysis_interval=10,
-        threshold=0.1,
-        handler=find_spikes,
-        output_modalities={
-            "speed": -1.0,
-            "smoothness": -1.0,
-            "rotation": -1.0,
-        },  # negative weight to reverse slope analysis
-    ),
-    Producer(
-        "blinks",
-        analysis_interval=300,
-        threshold=0.1,
-        handler="_handle_trend",
-        output_modalities={
-            "episodic_behaviour": -1.0,
-            "rotation": -1.0,
-        },  # negative weight to reverse slope analysis
-    ),
-]
-PRODUCER_MAP = {producer.subscription_topic: producer for producer in PRODUCERS}
-
-MODALITIES = [
-    Modality(
-        "speed",
-        threshold=0.3,
-        base_url=ROBOT_CONTROLLER_URL,
-        increase_path="/increase_speed",
-        decrease_path="/decrease_speed",
-        cooldown_duration=0.5,
-    ),
-    Modality(
-        "proxemics",
-        threshold=0.2,
-        base_url=ROBOT_CONTROLLER_URL,
-        increase_path="/increase_proxemics",
-        decrease_path="/decrease_proxemics",
-        cooldown_duration=0.5,
-    ),
-    Modality(
-        "smoothness",
-        threshold=0.1,
-        base_url=ROBOT_CONTROLLER_URL,
-        increase_path="/add_smoothness",
-        decrease_path="/remove_smoothness",
-        cooldown_duration=10,
-    ),
-    Modality(
-        "rotation",
-        threshold=0.1,
-        base_url=ROBOT_CONTROLLER_URL,
-        increase_path="/add_rotations",
-        decrease_path="/remove_rotations",
-        cooldown_duration=10,
-    ),
-    Modality(
-        "episodic_behaviour",
-        threshold=0.3,
-        base_url=ROBOT_CONTROLLER_URL,
-        increase_path="/episodic_behaviour",
-        cooldown_duration=300,
-    ),
-]
-MODALITIES_MAP = {modality.name: modality for modality in MODALITIES}
-
-df = pd.DataFrame(
-    columns=["output_modality", "value"], index=pd.DatetimeIndex(name="time", data=[])
+USE_MQTT = os.getenv("USE_MQTT", "false").lower() == "true"
+MQTT_BROKER = os.getenv("MQTT_BROKER", "mqtt-broker")
+MQTT_PORT = int(os.getenv("MQTT_PORT", "1883"))
+
+RECORDING_DIR = os.getenv("RECORDING_DIR")  # session recording is off if not set
+RECORDING_MAX_BYTES = int(os.getenv("RECORDING_MAX_BYTES", str(2 * 1024**3)))
+
+# producers and modalities, reloaded when the file changes
+PIPELINE_CONFIG = os.getenv("PIPELINE_CONFIG")  # defaults to pipeline.json
+
+# further robot cells as "<session>=<robot controller url>,..."
+SESSIONS = os.getenv("SESSIONS", "")
+# 0 analyses all sessions in the serving process, otherwise they are sharded
+SESSION_WORKERS = int(os.getenv("SESSION_WORKERS", "0"))
+
+TOPICS = [entry["subscription_topic"] for entry in load_config(PIPELINE_CONFIG)["producers"]]
+
+brokers = {}  # session id -> EventBroker, created on the first subscriber
+
+
+def publish_event(session_id: str, event: str, data):
+    broker = brokers.get(session_id, None)
+    if broker:
+        broker.publish(event, data)
+
+
+session_options = {
+    "publish": publish_event,
+    "config_path": PIPELINE_CONFIG,
+    "recording_dir": RECORDING_DIR,
+    "recording_max_bytes": RECORDING_MAX_BYTES,
+}
+sessions = (
+    ShardedSessions(SESSION_WORKERS, **session_options)
+    if SESSION_WORKERS > 0
+    else LocalSessions(**session_options)
 )
-last_analysed_data = {}
+sessions.create(DEFAULT_SESSION, ROBOT_CONTROLLER_URL)
+for entry in filter(None, SESSIONS.split(",")):
+    name, robot_url = entry.split("=", 1)
+    sessions.create(name.strip(), robot_url.strip())
 
 # Default start values to be used with experience
 PROXEMICS_MULTIPLIER = (
@@ -124,49 +78,16 @@ SMOOTHNESS_THRESHOLD = 3  # TODO handle that only smoothness or rotation is set
 ROTATION_THRESHOLD = 2
 
 app = Flask(__name__)
-CORS(app)
-analysis_cooldown = datetime.now() + timedelta(seconds=ANALYSIS_INTERVAL)
-
-
-def get_influences():
-    modalities = {modality.name: {} for modality in MODALITIES}
-    for producer in PRODUCERS:
-        for modality, value in producer._modalities.items():
-            if modality in modalities:
-                modalities[modality][producer.subscription_topic] = value
-    return modalities
-
-
-def analyse_signals():
-    modalities = {modality.name: 0 for modality in MODALITIES}
-    analysed_data = {producer.subscription_topic: {} for producer in PRODUCERS}
-    for producer in PRODUCERS:
-        singleOutputs = producer.handle()
-        analysed_data[producer.subscription_topic] = producer._data.to_json()
-        for modality, value in singleOutputs.items():
-            if modality in modalities:
-                modalities[modality] += value
-
-    print(modalities, flush=True)
-
-    publish_data = False
-    for modality_name, value in modalities.items():
-        modality = MODALITIES_MAP.get(modality_name, None)
-        if not modality:
-            continue
-
-        if value > modality.threshold:
-            publish_data = True
-            modality.increase()
-        elif value < -modality.threshold:
-            publish_data = True
-            modality.decrease()
-        else:
-            modality.neutral()
+CORS(app, expose_headers=["ETag"])
+
+
+def session_id():
+    return request.args.get("session", default=DEFAULT_SESSION)
 
-    if publish_data:
-        global last_analysed_data
-        last_analysed_data = analysed_data
+
+@app.errorhandler(SessionNotFound)
+def session_not_found(e):
+    return {"response": "Session {} not found.".format(e.args[0])}, 404
 
 
 def get_linkedIn_estimate(operator: str):
@@ -226,73 +147,122 @@ def bootstrap_parameters():
     post_bootstrapped_params(params)
 
 
-def _set_cooldown():
-    global analysis_cooldown
-    now = datetime.now()
-    analysis_cooldown = now + timedelta(seconds=ANALYSIS_INTERVAL)
-
-
 @app.route("/data", methods=["GET", "POST"])
 def data():
     if request.method == "GET":
-        global last_analysed_data
-        last_analysed_data["influences"] = get_influences()
-        print(last_analysed_data, flush=True)
-        return last_analysed_data
-
-    if request.json:
-        data = request.json
-        producer = PRODUCER_MAP.get(data["topic"], None)
-        if producer:
-            # append data to producer df and handle the data
-            del data["topic"]
-            producer.add_data(data)
-            # value = producer.handle(data)
-
-            # # append handled data to global df
-            # global df
-            # df = pd.concat([df, value]) if df is not None else value
-
-            global analysis_cooldown
-            if analysis_cooldown < datetime.now():
-                _set_cooldown()
-                analyse_signals()
-                return {
-                    "response": "Data received and handled. Analysis performed.",
-                }, 202
-
-            return {
-                "response": "Data received and handled.",
-            }, 200
+        return get_data_snapshot()
+
+    # invalid samples are rejected with 400, like they are counted as rejected in batches
+    try:
+        data = decode_body(request)
+        if isinstance(data, list):
+            return ingest_samples(data), 200
+        if data and not isinstance(data, dict):
+            raise ValueError("Expected a sample or a list of samples.")
+        added = data and sessions.call(session_id(), "add_sample", data)
+    except SessionNotFound:
+        raise
+    except (KeyError, TypeError, ValueError) as e:
+        return {"response": "Invalid sample: {}".format(e)}, 400
+    if added:
+        return {
+            "response": "Data received and handled.",
+        }, 200
     return {"response": "Could not associate the incoming data with any producer."}
 
 
+@app.route("/stream", methods=["GET"])
+def stream():
+    session = session_id()
+    influences = sessions.call(session, "get_influences")
+    broker = brokers.setdefault(session, EventBroker())
+
+    def events():
+        try:
+            yield from broker.stream(initial=[("influences", influences)])
+        finally:
+            if not broker.has_subscribers:
+                sessions.call(session, "set_streaming", False)
+
+    sessions.call(session, "set_streaming", True)
+    return Response(
+        events(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def get_data_snapshot():
+    """Serve the producer windows, serialised only when they are requested.
+
+    Clients can revalidate with If-None-Match to get a 304 while no sample
+    arrived, and pass ``since`` (epoch milliseconds) to only receive the
+    samples after that time.
+    """
+    since = request.args.get("since", default=None, type=float)
+    etag, snapshot = sessions.call(
+        session_id(), "data", since, list(request.if_none_match)
+    )
+    response = make_response("", 304) if snapshot is None else make_response(snapshot)
+    response.set_etag(etag)
+    return response
+
+
+def ingest_samples(samples):
+    return sessions.ingest(session_id(), samples)
+
+
+@app.route("/data/batch", methods=["POST"])
+def data_batch():
+    # consume streamed bodies sample by sample instead of buffering them
+    if request.mimetype == NDJSON_MIMETYPE:
+        return ingest_samples(ndjson_samples(request.stream)), 200
+    if request.mimetype == MSGPACK_MIMETYPE:
+        return ingest_samples(msgpack_samples(request.stream)), 200
+
+    try:
+        samples = decode_body(request)
+    except ValueError as e:
+        return {"response": str(e)}, 400
+    if not isinstance(samples, list):
+        return {"response": "Expected a JSON array of samples."}, 400
+    return ingest_samples(samples), 200
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(sessions.metrics(), mimetype=PROMETHEUS_MIMETYPE)
+
+
+@app.route("/sessions", methods=["GET", "POST"])
+def session_list():
+    if request.method == "GET":
+        return {"sessions": sessions.list()}
+    data = request.json
+    if not data.get("session") or not data.get("robot_url"):
+        return {"response": "Expected session and robot_url."}, 400
+    if sessions.create(data["session"], data["robot_url"]):
+        return {"response": "Session created."}, 201
+    return {"response": "Session already exists."}, 409
+
+
+@app.route("/config", methods=["POST"])
+def config():
+    try:
+        sessions.call(session_id(), "apply_config", request.json)
+    except SessionNotFound:
+        raise
+    except (KeyError, TypeError, ValueError) as e:
+        return {"response": "Invalid pipeline config: {}".format(e)}, 400
+    return {"response": "Pipeline config applied."}, 200
+
+
 @app.route("/producers", methods=["GET", "POST"])
 def producers():
     if request.method == "GET":
-        return {
-            "producers": [
-                {
-                    "subscription_topic": p.subscription_topic,
-                    "analysis_interval": p._analysis_interval,
-                    "threshold": p._threshold,
-                    "output_modalities": p._modalities,
-                }
-                for p in PRODUCERS
-            ]
-        }
+        return {"producers": sessions.call(session_id(), "producers")}
     elif request.method == "POST":
-        data = request.json
-        subscription_topic = data["subscription_topic"]
-        producer = PRODUCER_MAP.get(subscription_topic, None)
-        if producer:
-            # only update the values that are in the request
-            if "analysis_interval" in data:
-                producer._analysis_interval = data["analysis_interval"]
-            if "threshold" in data:
-                producer._threshold = data["threshold"]
-            if "output_modalities" in data:
-                producer._modalities = data["output_modalities"]
+        if sessions.call(session_id(), "update_producer", request.json):
             return {"response": "Producer updated."}, 200
         else:
             return {"response": "Producer not found."}, 404
@@ -301,31 +271,24 @@ def producers():
 @app.route("/modalities", methods=["GET", "POST"])
 def modalities():
     if request.method == "GET":
-        return {
-            "modalities": [
-                {
-                    "name": m.name,
-                    "threshold": m.threshold,
-                    "cooldown_duration": m.cooldown_duration,
-                }
-                for m in MODALITIES
-            ]
-        }
+        return {"modalities": sessions.call(session_id(), "modalities")}
     elif request.method == "POST":
-        data = request.json
-        name = data["name"]
-        modality = MODALITIES_MAP.get(name, None)
-        if modality:
-            # only update the values that are in the request
-            if "threshold" in data:
-                modality.threshold = data["threshold"]
-            if "cooldown_duration" in data:
-                modality.cooldown_duration = data["cooldown_duration"]
+        if sessions.call(session_id(), "update_modality", request.json):
             return {"response": "Modality updated."}, 200
         else:
             return {"response": "Modality not found."}, 404
 
 
+def start_background():
+    """Start the analysis of the sessions and the MQTT ingestion."""
+    sessions.start()
+    if USE_MQTT:
+        MqttIngest(TOPICS, sessions.send, MQTT_BROKER, MQTT_PORT).start()
+
+
 if __name__ == "__main__":
     bootstrap_parameters()
-    app.run(debug=True, host="0.0.0.0", port="5000")
+    # with the debug reloader only the serving child process runs the background threads
+    if not DEBUG or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_background()
+    app.run(debug=DEBUG, host="0.0.0.0", port="5000")
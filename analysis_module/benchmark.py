@@ -0,0 +1,217 @@
+"""Benchmarks for the analysis module hot paths.
+
+Measures the ingestion throughput of Producer.add_data, the latency of
+every handler and of a full analysis tick for growing windows, and the
+/data routes through Flask's test client. The robot controller is
+replaced by a stub dispatcher, so nothing leaves the process.
+
+    python3 benchmark.py [--rates 50 200 1000] [--windows 0.5 10 300] [--repeat 200]
+"""
+import argparse
+import contextlib
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+import msgpack
+import numpy as np
+
+from further_handlers import find_spikes, handle_expression
+from producer import Producer
+
+EXPRESSIONS = ["angry", "fear", "neutral", "sad", "disgust", "happy", "surprise"]
+HANDLERS = {
+    "_handle_trend": ("_handle_trend", np.float64),
+    "_online_trend": ("_online_trend", np.float64),
+    "handle_expression": (handle_expression, object),
+    "_handle_expression": ("_handle_expression", np.int8),
+    "find_spikes": (find_spikes, np.float64),
+    "_find_spikes": ("_find_spikes", np.float64),
+}
+
+
+def report(line: str):
+    # handler output is silenced during the runs, results go to the real stdout
+    print(line, file=sys.__stdout__, flush=True)
+
+
+class StubDispatcher(object):
+    """Counts actuations instead of sending them to the robot controller."""
+
+    def __init__(self):
+        self.submitted = 0
+
+    def submit(self, name, method, url, body=None, timeout=None):
+        self.submitted += 1
+        return True
+
+
+def sample_value(handler_name: str, i: int):
+    if handler_name in ("handle_expression", "_handle_expression"):
+        return EXPRESSIONS[i % len(EXPRESSIONS)]
+    return 3.0 + 0.001 * i + np.random.random() * 0.01
+
+
+def percentiles(durations: list) -> str:
+    durations = np.array(durations) * 1e6
+    return "p50 {:9.1f}us  p99 {:9.1f}us".format(
+        np.percentile(durations, 50), np.percentile(durations, 99)
+    )
+
+
+def fill(producer: Producer, handler_name: str, rate: float, window: float):
+    count = int(rate * window)
+    start = time.time()
+    for i in range(count):
+        producer.append(start + i / rate, sample_value(handler_name, i))
+    return start + count / rate, count
+
+
+def bench_add_data(rate: float, window: float, samples: int):
+    producer = Producer(
+        "bench", window, 0.001, "_online_trend", {"speed": 1.0}, capacity=8192
+    )
+    now, count = fill(producer, "_online_trend", rate, window)
+    data = [
+        {"value": 3.0, "timestamp": (datetime.now() + timedelta(seconds=i / rate)).isoformat()}
+        for i in range(samples)
+    ]
+    started = time.perf_counter()
+    for sample in data:
+        producer.add_data(sample)
+    elapsed = time.perf_counter() - started
+    report(
+        "add_data          rate {:6.0f}Hz window {:6.1f}s ({:6d} samples): {:10.0f} samples/s".format(
+            rate, window, len(producer.values), samples / elapsed
+        )
+    )
+
+
+def bench_handler(handler_name: str, rate: float, window: float, repeat: int):
+    handler, dtype = HANDLERS[handler_name]
+    producer = Producer(
+        "bench", window, 0.1, handler, {"speed": 1.0}, capacity=8192, dtype=dtype
+    )
+    now, count = fill(producer, handler_name, rate, window)
+    durations = []
+    for i in range(repeat):
+        # one new sample per tick, like a steadily streaming producer
+        producer.append(now + i / rate, sample_value(handler_name, count + i))
+        started = time.perf_counter()
+        producer.handle()
+        durations.append(time.perf_counter() - started)
+    report(
+        "{:17s} rate {:6.0f}Hz window {:6.1f}s ({:6d} samples): {}".format(
+            handler_name, rate, window, len(producer.values), percentiles(durations)
+        )
+    )
+
+
+def bench_app(rate: float, repeat: int):
+    # analyse the sessions in this process, so the tick can be timed directly
+    os.environ["SESSION_WORKERS"] = "0"
+    import app
+
+    stub = StubDispatcher()
+    shard = app.sessions.shard
+    for session in shard.sessions.values():
+        session.pipeline.verbose = False
+        for modality in session.pipeline.modalities:
+            modality._dispatcher = stub
+            modality.verbose = False
+    client = app.app.test_client()
+
+    def post_json(i):
+        return client.post(
+            "/data",
+            json={
+                "topic": "pupil",
+                "value": sample_value("_online_trend", i),
+                "timestamp": datetime.now().isoformat(),
+            },
+        )
+
+    def post_msgpack(i):
+        return client.post(
+            "/data",
+            data=msgpack.packb(
+                {
+                    "topic": "pupil",
+                    "value": sample_value("_online_trend", i),
+                    "timestamp": time.time_ns(),
+                }
+            ),
+            headers={"Content-Type": "application/msgpack"},
+        )
+
+    for name, post in (("POST /data json", post_json), ("POST /data msgpack", post_msgpack)):
+        durations = []
+        for i in range(repeat):
+            started = time.perf_counter()
+            post(i)
+            durations.append(time.perf_counter() - started)
+        report(
+            "{:19s} {:10.0f} requests/s  {}".format(
+                name, len(durations) / sum(durations), percentiles(durations)
+            )
+        )
+
+    batch = [
+        {
+            "topic": "pupil",
+            "value": sample_value("_online_trend", i),
+            "timestamp": time.time_ns() + i * int(1e9 / rate),
+        }
+        for i in range(100)
+    ]
+    body = msgpack.packb(batch)
+    durations = []
+    for i in range(max(1, repeat // 10)):
+        started = time.perf_counter()
+        client.post(
+            "/data/batch", data=body, headers={"Content-Type": "application/msgpack"}
+        )
+        durations.append(time.perf_counter() - started)
+    report(
+        "{:19s} {:10.0f} samples/s   {}".format(
+            "POST /data/batch", 100 * len(durations) / sum(durations), percentiles(durations)
+        )
+    )
+
+    durations = []
+    for i in range(repeat):
+        post_msgpack(i)
+        started = time.perf_counter()
+        shard.analyse()
+        durations.append(time.perf_counter() - started)
+    report(
+        "{:19s} {:10.0f} ticks/s     {}  ({} actuations)".format(
+            "analysis tick", len(durations) / sum(durations), percentiles(durations), stub.submitted
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rates", type=float, nargs="+", default=[50, 200])
+    parser.add_argument("--windows", type=float, nargs="+", default=[0.5, 10, 30])
+    parser.add_argument("--handlers", nargs="+", default=list(HANDLERS))
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--samples", type=int, default=10000)
+    args = parser.parse_args()
+
+    # handlers print their findings, which would distort the measurements
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for rate in args.rates:
+            for window in args.windows:
+                bench_add_data(rate, window, args.samples)
+        for handler_name in args.handlers:
+            for rate in args.rates:
+                for window in args.windows:
+                    bench_handler(handler_name, rate, window, args.repeat)
+        bench_app(max(args.rates), args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,20 @@
+import time
+
+
+class WallClock(object):
+    def now(self) -> float:
+        return time.time()
+
+
+class VirtualClock(object):
+    """Clock that only moves when told to, used to replay sessions."""
+
+    def __init__(self, start: float = 0.0):
+        self._now = start
+
+    def now(self) -> float:
+        return self._now
+
+    def advance_to(self, timestamp: float):
+        if timestamp > self._now:
+            self._now = timestamp
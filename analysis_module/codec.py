@@ -0,0 +1,50 @@
+import json
+import msgpack
+
+MSGPACK_MIMETYPE = "application/msgpack"
+NDJSON_MIMETYPE = "application/x-ndjson"
+
+
+def decode_body(request):
+    """Decode a sample or a list of samples according to the Content-Type.
+
+    msgpack bodies carry ``timestamp`` as epoch nanoseconds and need no
+    ``id``; everything else is parsed as JSON. Raises ValueError if the
+    body cannot be decoded.
+    """
+    if request.mimetype == MSGPACK_MIMETYPE:
+        try:
+            return msgpack.unpackb(request.get_data(), raw=False)
+        except (msgpack.UnpackException, ValueError) as e:
+            reason = str(e) or type(e).__name__
+            raise ValueError("Invalid msgpack body: {}".format(reason))
+    body = request.get_json(silent=True)
+    if body is None:
+        raise ValueError("Invalid JSON body.")
+    return body
+
+
+def ndjson_samples(stream):
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            # counted as rejected when ingested
+            yield None
+
+
+def msgpack_samples(stream):
+    """Stream-decode concatenated msgpack samples or arrays of samples."""
+    unpacker = msgpack.Unpacker(stream, raw=False)
+    try:
+        for item in unpacker:
+            if isinstance(item, list):
+                yield from item
+            else:
+                yield item
+    except (msgpack.UnpackException, ValueError):
+        # the rest of the body cannot be decoded, counted as one rejected sample
+        yield None
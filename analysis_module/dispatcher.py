@@ -0,0 +1,133 @@
+import queue
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import ACTUATION_BUCKETS, Histogram
+
+
+class ActuationStats(object):
+    def __init__(self):
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.last_latency = 0.0
+        self.latency = Histogram(ACTUATION_BUCKETS)
+
+    def record(self, latency: float, ok: bool):
+        self.sent += 1
+        if not ok:
+            self.failed += 1
+        self.latency_total += latency
+        self.latency_max = max(self.latency_max, latency)
+        self.last_latency = latency
+        self.latency.observe(latency)
+
+    def to_dict(self):
+        return {
+            "sent": self.sent,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "latency_avg": self.latency_total / self.sent if self.sent else 0.0,
+            "latency_max": self.latency_max,
+            "latency_last": self.last_latency,
+        }
+
+
+class ActuationDispatcher(object):
+    """Sends modality requests to the robot controller from worker threads.
+
+    Requests share one keep-alive connection pool and are taken from a
+    bounded queue. If the queue is full the request is dropped and counted,
+    so a slow robot controller never blocks the analysis tick.
+    """
+
+    def __init__(
+        self,
+        workers: int = 2,
+        queue_size: int = 32,
+        timeout: float = 2.0,
+        pool_size: int = 4,
+    ):
+        self.timeout = timeout
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+        self.recorder = None
+        self._workers = [
+            threading.Thread(target=self._work, name="actuation-{}".format(i), daemon=True)
+            for i in range(workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def _get_stats(self, name: str) -> ActuationStats:
+        with self._stats_lock:
+            if name not in self._stats:
+                self._stats[name] = ActuationStats()
+            return self._stats[name]
+
+    def stats(self, name: str = None):
+        if name is not None:
+            return self._get_stats(name).to_dict()
+        with self._stats_lock:
+            return {name: stats.to_dict() for name, stats in self._stats.items()}
+
+    def stats_objects(self) -> dict:
+        with self._stats_lock:
+            return dict(self._stats)
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def submit(
+        self, name, method: str, url: str, body: dict = None, timeout: float = None
+    ):
+        """Queue a request of the modality ``name``, or of a tuple of modalities."""
+        names = (name,) if isinstance(name, str) else tuple(name)
+        try:
+            self._queue.put_nowait((names, method, url, body, timeout or self.timeout))
+            return True
+        except queue.Full:
+            for name in names:
+                stats = self._get_stats(name)
+                with self._stats_lock:
+                    stats.dropped += 1
+                if self.recorder:
+                    self.recorder.record_actuation(
+                        time.time(), name, method, url, "dropped", 0.0
+                    )
+            print("actuation queue full, dropped {} {}".format(method, url), flush=True)
+            return False
+
+    def _work(self):
+        while True:
+            names, method, url, body, timeout = self._queue.get()
+            started = time.monotonic()
+            ok = False
+            try:
+                response = self._session.request(
+                    method, url, json=body, timeout=timeout
+                )
+                ok = response.ok
+            except requests.RequestException as e:
+                print("actuation {} {} failed: {}".format(method, url, e), flush=True)
+            latency = time.monotonic() - started
+            # a batched request counts for each of its modalities
+            for name in names:
+                stats = self._get_stats(name)
+                with self._stats_lock:
+                    stats.record(latency, ok)
+                if self.recorder:
+                    self.recorder.record_actuation(
+                        time.time(), name, method, url, "ok" if ok else "failed", latency
+                    )
+            self._queue.task_done()
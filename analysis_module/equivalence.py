@@ -0,0 +1,233 @@
+"""Equivalence checks for the streaming handlers and the batched actuation.
+
+Every streaming handler runs side by side with the handler it replaces on
+the same random sample stream, through Producer so the time windows and
+evictions are the ones of the pipeline, and both results are compared
+after every sample. A generated session is replayed once with batched
+PATCH /params requests and once with one request per modality, and the
+parameter changes of every tick are compared. A tick that decreases a
+modality without a decrease route must still send the other changes.
+
+    python3 equivalence.py [--samples 8000] [--seed 0]
+
+Exits with status 1 if any check finds a mismatch.
+"""
+import argparse
+import contextlib
+import copy
+import logging
+import os
+import sys
+
+import numpy as np
+
+from benchmark import report
+from further_handlers import find_spikes, handle_expression
+from modality import merge_change
+from clock import VirtualClock
+from pipeline import Pipeline, create_modalities, create_producers, load_config
+from producer import Producer
+from replay import TimelineDispatcher, replay
+from streaming_handlers import EXPRESSIONS
+
+SESSION_DURATION = 600.0  # seconds of the generated session
+
+
+def compare_handlers(name, original, streaming, dtypes, interval, threshold, samples):
+    """Run both handlers on the same (timestamp, value) samples, count mismatches."""
+    producers = [
+        Producer(name, interval, threshold, handler, {"speed": 1.0}, dtype=dtype)
+        for handler, dtype in zip((original, streaming), dtypes)
+    ]
+    mismatches = 0
+    for timestamp, value in samples:
+        results = []
+        for producer in producers:
+            producer.append(timestamp, value)
+            results.append(producer.evaluate())
+        if results[0] != results[1]:
+            mismatches += 1
+    report(
+        "{:40s} {:6d} windows: {} mismatches".format(
+            "{} vs {}".format(streaming, getattr(original, "__name__", original)),
+            len(samples),
+            mismatches,
+        )
+    )
+    return mismatches
+
+
+def timestamps(rng, count: int, rate: float):
+    # irregular arrival, so the windows hold a varying number of samples
+    return np.cumsum(rng.exponential(1.0 / rate, count)).tolist()
+
+
+def check_trend(rng, count: int) -> int:
+    # a random walk whose slope often lies between the threshold and its 5x cut-off
+    values = 3.0 + np.cumsum(rng.normal(0.0, 0.002, count))
+    samples = list(zip(timestamps(rng, count, 50.0), values.tolist()))
+    dtypes = (np.float64, np.float64)
+    return compare_handlers(
+        "pupil", "_handle_trend", "_online_trend", dtypes, 0.5, 0.001, samples
+    )
+
+
+def check_spikes(rng, count: int) -> int:
+    # integer heart rates produce the plateaus and ties find_peaks is picky about
+    values = 70 + np.cumsum(rng.integers(-1, 2, count))
+    spikes = rng.random(count) < 0.05
+    values = values + spikes * rng.integers(-8, 9, count)
+    samples = list(zip(timestamps(rng, count, 1.0), values.astype(float).tolist()))
+    dtypes = (np.float64, np.float64)
+    return compare_handlers(
+        "heartrate", find_spikes, "_find_spikes", dtypes, 10, 2, samples
+    )
+
+
+def check_expressions(rng, count: int) -> int:
+    labels = rng.choice(EXPRESSIONS, count).tolist()
+    samples = list(zip(timestamps(rng, count, 2.0), labels))
+    # the original handler works on the labels, the streaming one on their codes
+    dtypes = (object, np.int8)
+    return compare_handlers(
+        "expression", handle_expression, "_handle_expression", dtypes, 3, -2, samples
+    )
+
+
+def topic_samples(topic: str, times: np.ndarray, values: np.ndarray) -> list:
+    return list(zip(times.tolist(), [topic] * len(times), values.tolist()))
+
+
+def generate_session(rng):
+    """Samples of all pipeline topics in the /data format, sorted by time."""
+    samples = []
+    # pupil at 200Hz, drifting up, down or not at all for a few seconds at a time
+    times = np.arange(0.0, SESSION_DURATION, 0.005)
+    drift = rng.choice([-0.003, 0.0, 0.003], int(SESSION_DURATION / 5) + 1)
+    pupil = 3.0 + np.cumsum(drift[(times // 5).astype(int)])
+    pupil = pupil + rng.normal(0.0, 0.0005, len(times))
+    samples.extend(topic_samples("pupil", times, pupil))
+    seconds = np.arange(0.0, SESSION_DURATION, 1.0)
+    heartrate = 70 + np.cumsum(rng.integers(-1, 2, len(seconds)))
+    spikes = rng.random(len(seconds)) < 0.03
+    heartrate = (heartrate + spikes * rng.integers(-10, 11, len(seconds))).astype(float)
+    samples.extend(topic_samples("heartrate", seconds, heartrate))
+    distance = 550 + np.cumsum(rng.choice([-12.0, 0.0, 12.0], len(seconds)))
+    samples.extend(topic_samples("operator/distance", seconds, distance))
+    seconds = np.arange(0.0, SESSION_DURATION, 5.0)
+    # mostly negative expressions, so the episodic behaviour is triggered now and then
+    weights = [0.2, 0.1, 0.2, 0.1, 0.2, 0.1, 0.1]
+    expressions = rng.choice(EXPRESSIONS, len(seconds), p=weights)
+    samples.extend(topic_samples("expression", seconds, expressions))
+    samples.sort(key=lambda sample: sample[0])
+    times, topics, values = zip(*samples)
+    return np.array(times), list(topics), list(values)
+
+
+def tick_changes(timeline: list, paths: dict) -> dict:
+    """Parameter changes and remaining requests of the timeline per tick."""
+    ticks = {}
+    for entry in timeline:
+        changes, names, others = ticks.setdefault(entry["timestamp"], ({}, set(), []))
+        modalities = entry["modality"]
+        modalities = [modalities] if isinstance(modalities, str) else modalities
+        names.update(modalities)
+        if entry["method"] == "PATCH":
+            params = entry["body"]
+        else:
+            params = paths.get((modalities[0], entry["path"]), None)
+        if params is None:
+            others.append((entry["method"], entry["path"]))
+            continue
+        for name, change in params.items():
+            if name in changes:
+                change = merge_change(changes[name], change)
+            changes[name] = change
+    return ticks
+
+
+def check_batching(rng) -> int:
+    config = load_config()
+    unbatched = copy.deepcopy(config)
+    paths = {}
+    for modality in unbatched["modalities"]:
+        for kind in ("increase", "decrease"):
+            params = modality.pop(kind + "_params", None)
+            if params is not None:
+                paths[(modality["name"], modality[kind + "_path"])] = params
+
+    times, topics, values = generate_session(rng)
+    batched_timeline, _ = replay(times, topics, values, config=config)
+    single_timeline, _ = replay(times, topics, values, config=unbatched)
+    batched = tick_changes(batched_timeline, paths)
+    single = tick_changes(single_timeline, paths)
+    mismatches = sum(
+        1
+        for tick in set(batched) | set(single)
+        if batched.get(tick) != single.get(tick)
+    )
+    report(
+        "{:40s} {:6d} ticks: {} mismatches ({} batched vs {} single requests)".format(
+            "batched vs single actuation",
+            len(set(batched) | set(single)),
+            mismatches,
+            len(batched_timeline),
+            len(single_timeline),
+        )
+    )
+    return mismatches
+
+
+def check_trigger_decrease() -> int:
+    """Rising blinks decrease the episodic behaviour, which can only be triggered.
+
+    The other changes of the tick still have to be sent.
+    """
+    clock = VirtualClock(0.0)
+    dispatcher = TimelineDispatcher(clock)
+    pipeline = Pipeline(
+        create_producers(),
+        create_modalities("", dispatcher, clock=clock, verbose=False),
+        clock=clock,
+        verbose=False,
+    )
+    for i in range(10):
+        pipeline.producer_map["blinks"].append(i * 10.0, 10.0 + 0.3 * i)
+    clock.advance_to(100.0)
+    _, decisions = pipeline.analyse()
+    sent = [(entry["modality"], entry.get("body")) for entry in dispatcher.timeline]
+    expected = [(["rotation"], {"rotations": False})]
+    mismatches = int(decisions["episodic_behaviour"] != "decrease" or sent != expected)
+    report(
+        "{:40s} {:6d} ticks: {} mismatches (sent {})".format(
+            "decrease without a route", 1, mismatches, sent
+        )
+    )
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--samples", type=int, default=8000, help="samples per handler check"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    # the Segmenter warns about every short window
+    logging.getLogger("trend_classifier").setLevel(logging.ERROR)
+    # the original handlers print their findings
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        mismatches = (
+            check_trend(rng, args.samples)
+            + check_spikes(rng, args.samples)
+            + check_expressions(rng, args.samples)
+            + check_batching(rng)
+            + check_trigger_decrease()
+        )
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
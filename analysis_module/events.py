@@ -0,0 +1,60 @@
+import json
+import queue
+import threading
+
+
+class EventBroker(object):
+    """Fans out events to Server-Sent Events subscribers.
+
+    Every subscriber gets its own bounded queue. A subscriber that does not
+    keep up loses events instead of slowing down the publisher, so watching
+    dashboards never put load on the control path.
+    """
+
+    def __init__(self, queue_size: int = 256, heartbeat: float = 15.0):
+        self.queue_size = queue_size
+        self.heartbeat = heartbeat
+        self._subscribers = []
+        self._lock = threading.Lock()
+
+    @property
+    def has_subscribers(self) -> bool:
+        return len(self._subscribers) > 0
+
+    def subscribe(self) -> queue.Queue:
+        subscriber = queue.Queue(maxsize=self.queue_size)
+        with self._lock:
+            self._subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: queue.Queue):
+        with self._lock:
+            if subscriber in self._subscribers:
+                self._subscribers.remove(subscriber)
+
+    def publish(self, event: str, data):
+        if not self._subscribers:
+            return
+        message = "event: {}\ndata: {}\n\n".format(event, json.dumps(data))
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(message)
+            except queue.Full:
+                pass
+
+    def stream(self, initial: list = None):
+        """Generator producing the SSE body for one subscriber."""
+        subscriber = self.subscribe()
+        try:
+            for event, data in initial or []:
+                yield "event: {}\ndata: {}\n\n".format(event, json.dumps(data))
+            while True:
+                try:
+                    yield subscriber.get(timeout=self.heartbeat)
+                except queue.Empty:
+                    # comment line keeps proxies from closing the connection
+                    yield ": heartbeat\n\n"
+        finally:
+            self.unsubscribe(subscriber)
@@ -1,8 +1,8 @@
-import pandas as pd
+import numpy as np
 from scipy.signal import find_peaks
 
 
-def handle_expression(df: pd.DataFrame, threshold: float):
+def handle_expression(values: np.ndarray, threshold: float):
     emotions = {
         "angry": -1,
         "fear": -1,
@@ -14,7 +14,7 @@ def handle_expression(df: pd.DataFrame, threshold: float):
     }
 
     running_sum = 0
-    for expression in df["value"].tolist():
+    for expression in values:
         running_sum += emotions[expression]
 
     if running_sum < threshold:
@@ -23,8 +23,7 @@ def handle_expression(df: pd.DataFrame, threshold: float):
         return 0
 
 
-def find_spikes(df: pd.DataFrame, threshold: float):
-    values = df["value"].to_numpy()
+def find_spikes(values: np.ndarray, threshold: float):
     # find positive and negative peaks
     pos_peaks, _ = find_peaks(values, distance=2, threshold=threshold)
     neg_peaks, _ = find_peaks(-values, distance=2, threshold=threshold)
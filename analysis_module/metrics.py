@@ -0,0 +1,172 @@
+from bisect import bisect_left
+
+PROMETHEUS_MIMETYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# upper bounds in seconds
+HANDLER_BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+)
+TICK_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+ACTUATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class Histogram(object):
+    """Fixed bucket histogram, rendered cumulatively like a Prometheus histogram."""
+
+    def __init__(self, buckets: tuple):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            yield bound, total
+
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        '{}="{}"'.format(
+            key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        )
+        for key, value in labels.items()
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+class MetricsWriter(object):
+    """Collects metric families and renders them in the Prometheus text format.
+
+    Samples are grouped per family, so several sessions or worker processes
+    can write into the same families and be merged before rendering.
+    """
+
+    def __init__(self, prefix: str = "ropudica_"):
+        self.prefix = prefix
+        self.families = {}  # name -> [kind, help, sample lines]
+        self._current = None
+
+    def family(self, name: str, kind: str, help: str):
+        if name not in self.families:
+            self.families[name] = [kind, help, []]
+        self._current = self.families[name][2]
+
+    def sample(self, name: str, value, labels: dict = None):
+        self._current.append(
+            "{}{}{} {}".format(
+                self.prefix, name, _format_labels(labels), _format_value(value)
+            )
+        )
+
+    def histogram(self, name: str, histogram: Histogram, labels: dict = None):
+        labels = labels or {}
+        for bound, count in histogram.cumulative():
+            self.sample(name + "_bucket", count, dict(labels, le=_format_value(bound)))
+        self.sample(name + "_sum", histogram.sum, labels)
+        self.sample(name + "_count", histogram.count, labels)
+
+    def merge(self, families: dict):
+        for name, (kind, help, lines) in families.items():
+            self.family(name, kind, help)
+            self._current.extend(lines)
+
+    def render(self) -> str:
+        lines = []
+        for name, (kind, help, samples) in self.families.items():
+            lines.append("# HELP {}{} {}".format(self.prefix, name, help))
+            lines.append("# TYPE {}{} {}".format(self.prefix, name, kind))
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+def collect(
+    out: MetricsWriter,
+    producers: list = (),
+    modalities: list = (),
+    scheduler=None,
+    dispatcher=None,
+    labels: dict = None,
+):
+    """Write the state of the analysis pipeline into ``out``.
+
+    ``labels`` are added to every sample, e.g. the session or worker.
+    """
+    labels = labels or {}
+
+    def topic(p):
+        return dict(labels, topic=p.subscription_topic)
+
+    if producers:
+        out.family("samples_ingested_total", "counter", "Samples appended per topic.")
+        for p in producers:
+            out.sample("samples_ingested_total", p.version, topic(p))
+        out.family("window_samples", "gauge", "Samples currently in the analysis window.")
+        for p in producers:
+            out.sample("window_samples", p.window_length, topic(p))
+        out.family("window_span_seconds", "gauge", "Time between the oldest and newest sample in the window.")
+        for p in producers:
+            out.sample("window_span_seconds", p.window_span, topic(p))
+        out.family("ingest_rate_hertz", "gauge", "Sample rate within the current window.")
+        for p in producers:
+            span = p.window_span
+            rate = (p.window_length - 1) / span if span > 0 else 0.0
+            out.sample("ingest_rate_hertz", rate, topic(p))
+        out.family("window_overflow_total", "counter", "Samples dropped from a full window before they left the analysis interval.")
+        for p in producers:
+            out.sample("window_overflow_total", p.overflowed, topic(p))
+        out.family("handler_cached_total", "counter", "Ticks answered from the cached producer output.")
+        for p in producers:
+            out.sample("handler_cached_total", p.cache_hits, topic(p))
+        out.family("handler_duration_seconds", "histogram", "Execution time of the producer handler per tick.")
+        for p in producers:
+            out.histogram("handler_duration_seconds", p.handler_duration, topic(p))
+
+    if scheduler is not None:
+        out.family("analysis_ticks_total", "counter", "Analysis ticks run.")
+        out.sample("analysis_ticks_total", scheduler.ticks, labels)
+        out.family("analysis_overruns_total", "counter", "Analysis ticks skipped because a tick ran too long.")
+        out.sample("analysis_overruns_total", scheduler.overruns, labels)
+        out.family("analysis_tick_duration_seconds", "histogram", "Duration of one analysis tick.")
+        out.histogram("analysis_tick_duration_seconds", scheduler.tick_duration, labels)
+
+    if modalities:
+        out.family("modality_decisions_total", "counter", "Modality decisions, suppressed ones were hit by the cooldown.")
+        for m in modalities:
+            for decision, count in m.decisions.items():
+                out.sample(
+                    "modality_decisions_total",
+                    count,
+                    dict(labels, modality=m.name, decision=decision),
+                )
+
+    if dispatcher is not None:
+        out.family("actuation_queue_depth", "gauge", "Actuation requests waiting to be sent.")
+        out.sample("actuation_queue_depth", dispatcher.queue_depth, labels)
+        stats = dispatcher.stats_objects()
+        out.family("actuations_failed_total", "counter", "Actuation requests that failed or returned an error.")
+        for name, s in stats.items():
+            out.sample("actuations_failed_total", s.failed, dict(labels, modality=name))
+        out.family("actuations_dropped_total", "counter", "Actuation requests dropped because the queue was full.")
+        for name, s in stats.items():
+            out.sample("actuations_dropped_total", s.dropped, dict(labels, modality=name))
+        out.family("actuation_duration_seconds", "histogram", "HTTP latency of actuation requests to the robot controller.")
+        for name, s in stats.items():
+            out.histogram("actuation_duration_seconds", s.latency, dict(labels, modality=name))
@@ -1,10 +1,52 @@
-from datetime import datetime, timedelta
 import requests
 from typing import Literal, Optional
+from clock import WallClock
+from dispatcher import ActuationDispatcher
 
 
 MethodLiteral = Literal["GET", "POST"]
 ModalityLiteral = Literal["speed", "smoothness", "rotation", "proxemics"]
+PARAMS_PATH = "/params"
+
+
+def merge_change(current, change):
+    """Change of one parameter by two modalities, as if sent one after another."""
+    if isinstance(current, dict) and isinstance(change, dict) and "by" in change:
+        if "by" in current:
+            return {"by": current["by"] + change["by"]}
+        return {"to": current["to"] + change["by"]}
+    # switches and absolute values: the later change wins
+    return change
+
+
+class ParamsBatch(object):
+    """Parameter changes of all modalities triggered in one analysis tick.
+
+    Sent as one ``PATCH /params``, which the robot controller applies at
+    once, instead of one request per modality. The request is accounted to
+    every modality in the batch.
+    """
+
+    def __init__(self):
+        self.changes = {}
+        self.names = []
+        self._modality = None
+
+    def add(self, modality, params: dict):
+        for name, change in params.items():
+            if name in self.changes:
+                change = merge_change(self.changes[name], change)
+            self.changes[name] = change
+        self.names.append(modality.name)
+        self._modality = modality
+
+    def send(self):
+        if not self.changes:
+            return None
+        modality = self._modality
+        return modality._request(
+            "PATCH", modality.base_url + PARAMS_PATH, self.changes, name=tuple(self.names)
+        )
 
 
 class Modality(object):
@@ -19,7 +61,13 @@ class Modality(object):
         increase_method: MethodLiteral = "POST",
         decrease_method: MethodLiteral = "POST",
         neutral_method: MethodLiteral = "POST",
+        increase_params: dict = None,
+        decrease_params: dict = None,
         cooldown_duration: int = 5,
+        dispatcher: Optional[ActuationDispatcher] = None,
+        timeout: float = 2.0,
+        clock=None,
+        verbose: bool = True,
         **kwargs,
     ):
         self.name = name
@@ -31,27 +79,63 @@ class Modality(object):
         self.decrease_method = decrease_method
         self.neutral_path = neutral_path
         self.neutral_method = neutral_method
+        # changes for PATCH /params, used instead of the paths when batching
+        self.increase_params = increase_params
+        self.decrease_params = decrease_params
         self.cooldown_duration = cooldown_duration
-        self._cooldown_end = datetime.now()
+        self.timeout = timeout
+        self._dispatcher = dispatcher
+        self._clock = clock or WallClock()
+        self.verbose = verbose
+        self._cooldown_end = self._clock.now()
+        # decisions per kind, suppressed ones arrived during the cooldown
+        self.decisions = {"increase": 0, "decrease": 0, "neutral": 0, "suppressed": 0}
 
     def _get(self, url: str):
-        response = requests.get(url)
+        if self._dispatcher:
+            return self._dispatcher.submit(self.name, "GET", url, timeout=self.timeout)
+        response = requests.get(url, timeout=self.timeout)
         return response
 
     def _post(self, url: str, body: dict = None):
-        response = requests.post(url, json=body) if body else requests.post(url)
+        if self._dispatcher:
+            return self._dispatcher.submit(
+                self.name, "POST", url, body, timeout=self.timeout
+            )
+        response = (
+            requests.post(url, json=body, timeout=self.timeout)
+            if body
+            else requests.post(url, timeout=self.timeout)
+        )
         return response
 
+    def _request(self, method: str, url: str, body: dict = None, name: str = None):
+        if self._dispatcher:
+            return self._dispatcher.submit(
+                name or self.name, method, url, body, timeout=self.timeout
+            )
+        return requests.request(method, url, json=body, timeout=self.timeout)
+
+    def _log(self, message: str):
+        if self.verbose:
+            print(message, flush=True)
+
     def _set_cooldown(self):
-        now = datetime.now()
-        self._cooldown_end = now + timedelta(seconds=self.cooldown_duration)
+        self._cooldown_end = self._clock.now() + self.cooldown_duration
 
-    def increase(self, body: dict = None):
-        if self._cooldown_end > datetime.now():
-            print("cooldown for {} not over, increase".format(self.name), flush=True)
+    def increase(self, body: dict = None, batch: ParamsBatch = None):
+        if self.increase_path is None and self.increase_params is None:
+            return None
+        if self._cooldown_end > self._clock.now():
+            self._log("cooldown for {} not over, increase".format(self.name))
+            self.decisions["suppressed"] += 1
             return None
-        print("would increase {}".format(self.name), flush=True)
+        self.decisions["increase"] += 1
+        self._log("would increase {}".format(self.name))
         self._set_cooldown()
+        if batch is not None and self.increase_params is not None:
+            batch.add(self, self.increase_params)
+            return True
         if self.increase_method == "POST":
             result = self._post(self.base_url + self.increase_path, body)
             self._set_cooldown()
@@ -62,12 +146,20 @@ class Modality(object):
             self._set_cooldown()
             return result
 
-    def decrease(self, body: dict = None):
-        if self._cooldown_end > datetime.now():
-            print("cooldown for {} not over, decrease".format(self.name), flush=True)
+    def decrease(self, body: dict = None, batch: ParamsBatch = None):
+        # e.g. the episodic behaviour can only be triggered
+        if self.decrease_path is None and self.decrease_params is None:
+            return None
+        if self._cooldown_end > self._clock.now():
+            self._log("cooldown for {} not over, decrease".format(self.name))
+            self.decisions["suppressed"] += 1
             return None
-        print("would decrease {}".format(self.name), flush=True)
+        self.decisions["decrease"] += 1
+        self._log("would decrease {}".format(self.name))
         self._set_cooldown()
+        if batch is not None and self.decrease_params is not None:
+            batch.add(self, self.decrease_params)
+            return True
         if self.decrease_method == "POST":
             result = self._post(self.base_url + self.decrease_path, body)
             self._set_cooldown()
@@ -79,13 +171,15 @@ class Modality(object):
             return result
 
     def neutral(self, body: dict = None):
-        if self._cooldown_end > datetime.now():
-            print("cooldown for {} not over, neutral".format(self.name), flush=True)
+        if self._cooldown_end > self._clock.now():
+            self._log("cooldown for {} not over, neutral".format(self.name))
+            self.decisions["suppressed"] += 1
             return None
+        self.decisions["neutral"] += 1
         if self.neutral_path is None:
-            print("no neutral path for {}".format(self.name), flush=True)
+            self._log("no neutral path for {}".format(self.name))
             return None
-        print("would neutral {}".format(self.name), flush=True)
+        self._log("would neutral {}".format(self.name))
         if self.neutral_method == "POST":
             result = self._post(self.base_url + self.neutral_path, body)
             return result
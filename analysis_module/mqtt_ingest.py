@@ -0,0 +1,84 @@
+import json
+from datetime import datetime, timezone
+
+import paho.mqtt.client as mqtt
+
+from sessions import DEFAULT_SESSION
+
+SESSION_PREFIX = "sessions/"
+
+
+class MqttIngest(object):
+    """Subscribes to the producer topics and hands the messages to the sessions.
+
+    Runs next to the HTTP ingestion; each MQTT topic maps directly onto a
+    producer subscription topic of the default session, and
+    ``sessions/<session>/<topic>`` onto the one of another session. A
+    message is either a JSON object with ``value`` and ``timestamp`` or a
+    bare JSON value, which is stamped on arrival.
+    """
+
+    def __init__(
+        self,
+        topics: list,
+        send,
+        host: str,
+        port: int = 1883,
+        qos: int = 0,
+        username: str = None,
+        password: str = None,
+    ):
+        self.topics = topics
+        self.send = send  # send(session_id, "ingest", samples)
+        self.host = host
+        self.port = port
+        self.qos = qos
+        self.received = 0
+        self.rejected = 0
+        if hasattr(mqtt, "CallbackAPIVersion"):
+            # paho-mqtt >= 2.0
+            self._client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+        else:
+            self._client = mqtt.Client()
+        if username:
+            self._client.username_pw_set(username, password)
+        self._client.on_connect = self._on_connect
+        self._client.on_message = self._on_message
+
+    def start(self):
+        self._client.connect_async(self.host, self.port)
+        self._client.loop_start()
+
+    def stop(self):
+        self._client.loop_stop()
+        self._client.disconnect()
+
+    def _on_connect(self, client, userdata, flags, *args):
+        # (re)subscribe on every connect, so a broker restart is survived
+        subscriptions = list(self.topics)
+        subscriptions += [SESSION_PREFIX + "+/" + topic for topic in self.topics]
+        client.subscribe([(topic, self.qos) for topic in subscriptions])
+        print("MQTT ingest subscribed to {}".format(subscriptions), flush=True)
+
+    def _on_message(self, client, userdata, message):
+        session_id, topic = DEFAULT_SESSION, message.topic
+        if topic.startswith(SESSION_PREFIX):
+            session_id, _, topic = topic[len(SESSION_PREFIX) :].partition("/")
+        if topic not in self.topics:
+            self.rejected += 1
+            return
+        try:
+            payload = json.loads(message.payload)
+            if not isinstance(payload, dict):
+                payload = {"value": payload}
+            if "timestamp" not in payload:
+                payload["timestamp"] = datetime.now(timezone.utc)
+            payload["topic"] = topic
+            self.send(session_id, "ingest", [payload])
+            self.received += 1
+        except (KeyError, TypeError, ValueError) as e:
+            self.rejected += 1
+            print(
+                "Could not ingest MQTT message on {}: {}".format(message.topic, e),
+                flush=True,
+            )
@@ -0,0 +1,215 @@
+import json
+import os
+
+import numpy as np
+
+from clock import WallClock
+from modality import Modality, ParamsBatch
+from producer import Producer
+
+ANALYSIS_INTERVAL = 0.1  # seconds
+DEFAULT_CONFIG_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "pipeline.json"
+)
+
+# modality attributes taken over on a reload, the cooldown is kept
+MODALITY_FIELDS = (
+    "threshold",
+    "base_url",
+    "increase_path",
+    "increase_method",
+    "decrease_path",
+    "decrease_method",
+    "neutral_path",
+    "neutral_method",
+    "increase_params",
+    "decrease_params",
+    "cooldown_duration",
+    "timeout",
+)
+
+
+def load_config(path: str = None) -> dict:
+    """Read a pipeline config from a JSON file, or a YAML file if PyYAML is installed.
+
+    The entries under ``producers`` and ``modalities`` are the keyword
+    arguments of Producer and Modality.
+    """
+    path = path or DEFAULT_CONFIG_PATH
+    with open(path) as f:
+        if path.endswith((".yaml", ".yml")):
+            try:
+                import yaml
+            except ImportError:
+                raise ImportError("PyYAML is required for YAML pipeline configs")
+            return yaml.safe_load(f)
+        return json.load(f)
+
+
+def create_producers(config: dict = None):
+    config = config or load_config()
+    return [Producer(**entry) for entry in config["producers"]]
+
+
+def create_modalities(
+    base_url: str, dispatcher=None, clock=None, verbose=True, config: dict = None
+):
+    config = config or load_config()
+    options = {
+        "base_url": base_url,
+        "dispatcher": dispatcher,
+        "clock": clock,
+        "verbose": verbose,
+    }
+    return [Modality(**options, **entry) for entry in config["modalities"]]
+
+
+class CompiledPipeline(object):
+    """Producers, modalities and the producers x modalities weight matrix.
+
+    Never changed after it is built; the pipeline swaps in a new one, so an
+    analysis tick always sees one consistent layout.
+    """
+
+    def __init__(self, producers: list, modalities: list):
+        self.producers = list(producers)
+        self.producer_map = {p.subscription_topic: p for p in self.producers}
+        self.modalities = list(modalities)
+        self.modality_map = {m.name: m for m in self.modalities}
+        self.modality_names = [m.name for m in self.modalities]
+        index = {name: j for j, name in enumerate(self.modality_names)}
+        self.weights = np.zeros((len(self.producers), len(self.modalities)))
+        for i, producer in enumerate(self.producers):
+            for name, weight in producer.output_modalities.items():
+                if name in index:
+                    self.weights[i, index[name]] = weight
+        self.thresholds = np.array(
+            [m.threshold for m in self.modalities], dtype=np.float64
+        )
+
+
+class Pipeline(object):
+    """Producers and modalities analysed together on every tick."""
+
+    def __init__(
+        self,
+        producers: list,
+        modalities: list,
+        clock=None,
+        recorder=None,
+        verbose: bool = True,
+    ):
+        self.clock = clock or WallClock()
+        self.recorder = recorder
+        self.verbose = verbose
+        self._compiled = None
+        self.apply(producers, modalities)
+
+    @property
+    def producers(self) -> list:
+        return self._compiled.producers
+
+    @property
+    def producer_map(self) -> dict:
+        return self._compiled.producer_map
+
+    @property
+    def modalities(self) -> list:
+        return self._compiled.modalities
+
+    @property
+    def modality_map(self) -> dict:
+        return self._compiled.modality_map
+
+    def compile(self):
+        """Rebuild the weight matrix after weights or thresholds were changed."""
+        self._compiled = CompiledPipeline(self.producers, self.modalities)
+
+    def apply(self, producers: list, modalities: list):
+        """Swap in a new set of producers and modalities in one step.
+
+        Producers with the same topic and layout and modalities with the same
+        name are reconfigured instead of replaced, so their windows and
+        cooldowns survive a reload.
+        """
+        current = self._compiled
+        if current is not None:
+            merged = []
+            for producer in producers:
+                old = current.producer_map.get(producer.subscription_topic, None)
+                if old is not None and old.layout == producer.layout:
+                    old.configure(
+                        analysis_interval=producer._analysis_interval,
+                        threshold=producer._threshold,
+                        output_modalities=producer.output_modalities,
+                        cadence=producer.cadence,
+                    )
+                    producer = old
+                merged.append(producer)
+            producers = merged
+            merged = []
+            for modality in modalities:
+                old = current.modality_map.get(modality.name, None)
+                if old is not None:
+                    for field in MODALITY_FIELDS:
+                        setattr(old, field, getattr(modality, field))
+                    modality = old
+                merged.append(modality)
+            modalities = merged
+        if self.recorder:
+            for producer in producers:
+                producer.recorder = self.recorder
+        self._compiled = CompiledPipeline(producers, modalities)
+
+    def get_influences(self):
+        modalities = {modality.name: {} for modality in self.modalities}
+        for producer in self.producers:
+            for modality, value in producer.output_modalities.items():
+                if modality in modalities:
+                    modalities[modality][producer.subscription_topic] = value
+        return modalities
+
+    def analyse(self):
+        """Run one analysis tick and trigger the modalities.
+
+        The producer results are weighted and summed per modality with one
+        matrix product. The parameter changes of the triggered modalities
+        are sent as one request. Returns the sums and the decision per modality.
+        """
+        compiled = self._compiled
+        now = self.clock.now()
+        values = np.fromiter(
+            (producer.evaluate(now) for producer in compiled.producers),
+            dtype=np.float64,
+            count=len(compiled.producers),
+        )
+        sums = values @ compiled.weights
+        modalities = dict(zip(compiled.modality_names, sums.tolist()))
+
+        if self.verbose:
+            print(modalities, flush=True)
+        if self.recorder:
+            self.recorder.record_decision(now, modalities)
+
+        increase = sums > compiled.thresholds
+        decrease = sums < -compiled.thresholds
+        decisions = {}
+        # modalities with params are sent together as one update
+        batch = ParamsBatch()
+        for j, modality in enumerate(compiled.modalities):
+            # a failing modality must not keep the others' changes from being sent
+            try:
+                if increase[j]:
+                    decisions[modality.name] = "increase"
+                    modality.increase(batch=batch)
+                elif decrease[j]:
+                    decisions[modality.name] = "decrease"
+                    modality.decrease(batch=batch)
+                else:
+                    decisions[modality.name] = "neutral"
+                    modality.neutral()
+            except Exception as e:
+                print("Could not actuate {}: {}".format(modality.name, e), flush=True)
+        batch.send()
+
+        return modalities, decisions
@@ -1,16 +1,49 @@
+import numpy as np
 import pandas as pd
+import threading
+import time
 import warnings
 
-from datetime import datetime, timedelta
 from trend_classifier import Segmenter
-from typing import Callable
 from types import FunctionType as function
+from further_handlers import find_spikes, handle_expression
+from metrics import HANDLER_BUCKETS, Histogram
 from modality import ModalityLiteral
+from streaming_handlers import (
+    Cusum,
+    EwmaDeviation,
+    ExpressionTally,
+    OnlineTrend,
+    PageHinkley,
+    RollingZScore,
+    SpikeDetector,
+    StreamingHandler,
+)
+from window import RingBuffer, to_epoch_seconds
 
-AVAILABLE_HANDLER = {"_handle_trend"}
+# maps handler names to Producer methods, functions or StreamingHandler classes
+AVAILABLE_HANDLER = {
+    "_handle_trend": "_handle_trend",
+    "_online_trend": OnlineTrend,
+    "_ewma_deviation": EwmaDeviation,
+    "_rolling_zscore": RollingZScore,
+    "_cusum": Cusum,
+    "_page_hinkley": PageHinkley,
+    "handle_expression": handle_expression,
+    "_handle_expression": ExpressionTally,
+    "find_spikes": find_spikes,
+    "_find_spikes": SpikeDetector,
+}
 
 
 class Producer(object):
+    """Window and handler of one subscription topic.
+
+    Samples are appended from the request threads while the analysis thread
+    handles the window, so every access to the buffer, the handler state and
+    the configuration goes through the producer's lock.
+    """
+
     def __init__(
         self,
         subscription_topic: str,
@@ -18,61 +51,237 @@ class Producer(object):
         threshold: float,
         handler: str | function,
         output_modalities: dict[ModalityLiteral, float],
+        capacity: int = 4096,
+        dtype=np.float64,
+        cadence: float = 0,
+        handler_options: dict = None,
         **kwargs,
     ):
         if len(output_modalities) == 0:
             raise ValueError("At least one output modality must be specified")
         self.subscription_topic = subscription_topic
-        self._data = pd.DataFrame(
-            columns=["value"], index=pd.DatetimeIndex(name="timestamp", data=[])
-        )
+        self._buffer = RingBuffer(capacity, dtype=dtype)
         self._analysis_interval = analysis_interval
         self._threshold = threshold
-        self._handler = Producer.match_function(handler)
+        self._handler = Producer.match_function(handler, handler_options)
+        self._streaming = isinstance(self._handler, StreamingHandler)
+        self._encode = self._handler.encode if self._streaming else None
+        # producers with the same layout can take over each other's window
+        self.layout = (
+            type(self._handler) if self._streaming else self._handler,
+            tuple(sorted((handler_options or {}).items())),
+            np.dtype(dtype),
+            capacity,
+        )
         self._modalities = output_modalities
+        # minimum seconds between two handler runs, the output is cached in between
+        self.cadence = cadence
+        self._output = 0
+        self._output_key = None  # (version, config version) the output was computed for
+        self._handled_at = None
+        self._config_version = 0
+        self._snapshot = (None, None)
+        self.recorder = None
+        self.handler_duration = Histogram(HANDLER_BUCKETS)
+        self.cache_hits = 0
+        # samples dropped because the buffer was full while still inside the interval
+        self.overflowed = 0
+        self._lock = threading.Lock()
 
     @staticmethod
-    def match_function(handler: str | function):
+    def match_function(
+        handler: str | function | type[StreamingHandler], options: dict = None
+    ):
+        if type(handler) is str and handler in AVAILABLE_HANDLER:
+            handler = AVAILABLE_HANDLER[handler]
+            if type(handler) is str:
+                return getattr(Producer, handler)
+
         if type(handler) is function:
             return handler
-        elif type(handler) is str and handler in AVAILABLE_HANDLER:
-            return getattr(Producer, handler)
+        elif isinstance(handler, type) and issubclass(handler, StreamingHandler):
+            # streaming handlers keep per-producer state
+            return handler(**(options or {}))
         else:
             raise TypeError(
-                "Handler must be a function or an existing handler method of Producer"
+                "Handler must be a function, a StreamingHandler or an existing handler of Producer"
             )
 
+    def configure(
+        self,
+        analysis_interval: float = None,
+        threshold: float = None,
+        output_modalities: dict = None,
+        cadence: float = None,
+    ):
+        with self._lock:
+            if analysis_interval is not None:
+                self._analysis_interval = analysis_interval
+            if threshold is not None:
+                self._threshold = threshold
+            if output_modalities is not None:
+                self._modalities = dict(output_modalities)
+            if cadence is not None:
+                self.cadence = cadence
+            self._config_version += 1
+
+    @property
+    def output_modalities(self) -> dict:
+        # configure replaces the dict instead of mutating it, so it can be iterated
+        return self._modalities
+
+    @property
+    def times(self) -> np.ndarray:
+        return self._buffer.times
+
+    @property
+    def values(self) -> np.ndarray:
+        return self._buffer.values
+
+    @property
+    def version(self) -> int:
+        # the window only changes when a sample is appended
+        return self._buffer.total
+
+    @property
+    def window_length(self) -> int:
+        return len(self._buffer)
+
+    @property
+    def window_span(self) -> float:
+        with self._lock:
+            times = self._buffer.times
+            return float(times[-1] - times[0]) if len(times) > 1 else 0.0
+
+    @property
+    def last_time(self):
+        with self._lock:
+            return self._buffer.last_time
+
+    def samples_since(self, version: int):
+        """Times and values appended after ``version`` that are still in the window."""
+        with self._lock:
+            times, values = self._buffer.tail(self.version - version)
+            return times.copy(), values.copy()
+
+    def to_frame(self, since: float = None) -> pd.DataFrame:
+        with self._lock:
+            return self._buffer.to_frame(since)
+
+    def snapshot(self, since: float = None) -> str:
+        """JSON of the window, serialised lazily and cached per version.
+
+        The split orient keeps samples that share a timestamp.
+        """
+        if since is not None:
+            return self.to_frame(since).to_json(orient="split")
+        version, snapshot = self._snapshot
+        if version != self.version:
+            with self._lock:
+                version = self.version
+                frame = self._buffer.to_frame()
+            snapshot = frame.to_json(orient="split")
+            self._snapshot = (version, snapshot)
+        return snapshot
+
     def add_data(self, data: dict):
-        new_df = pd.DataFrame.from_dict([data])
-        new_df.set_index(
-            pd.DatetimeIndex(data=new_df["timestamp"], name="timestamp"), inplace=True
-        )
-        new_df.drop(columns=["timestamp", "id"], inplace=True)
+        self.append(to_epoch_seconds(data["timestamp"]), data["value"])
+
+    def append(self, timestamp: float, value):
+        with self._lock:
+            self._append(timestamp, value)
+
+    def _append(self, timestamp: float, value):
+        # invalid values are rejected before anything changes, the handler
+        # gets the stored value, so the window, recordings and state agree
+        stored = self._encode(value) if self._encode else value
+        if len(self._buffer) == self._buffer.capacity:
+            if timestamp - self._buffer.times[0] < self._analysis_interval:
+                self._overflow()
+            self._evicted(self._buffer.evict(1))
+        self._buffer.append(timestamp, stored)
+        if self.recorder:
+            self.recorder.record_sample(self.subscription_topic, timestamp, stored)
+        if self._streaming:
+            self._handler.add(stored)
+        # keep the window relative to the newest sample, like DataFrame.last()
+        self._evicted(self._buffer.evict_before(timestamp - self._analysis_interval))
+
+    def _overflow(self):
+        if not self.overflowed:
+            print(
+                "Window of {} is full, its {}s analysis interval is truncated to {} samples".format(
+                    self.subscription_topic, self._analysis_interval, self._buffer.capacity
+                ),
+                flush=True,
+            )
+        self.overflowed += 1
 
-        temp_df = pd.concat([self._data, new_df])
-        self._data = temp_df.last(pd.Timedelta(seconds=self._analysis_interval))
+    def _evicted(self, values: np.ndarray):
+        if not self._streaming:
+            return
+        if len(values):
+            self._handler.evict(values)
+        if self._handler.stale:
+            self._handler.reset(self._buffer.values)
 
-    def handle(self):
-        value = self._handler(self._data, self._threshold)
+    def handle(self, now: float = None):
+        """Modality contributions of the current window."""
+        value = self.evaluate(now)
         output = {}
-        for modality, weight in self._modalities.items():
+        for modality, weight in self.output_modalities.items():
             output[modality] = value * weight if value else 0
 
         return output
 
+    def evaluate(self, now: float = None):
+        """Handler result for the current window.
+
+        The window only changes when a sample is appended, so the handler
+        only runs again after new data or a configuration change, and at
+        most once per ``cadence`` seconds. In between the cached result is
+        returned.
+        """
+        with self._lock:
+            return self._evaluate(now)
+
+    def _evaluate(self, now: float = None):
+        key = (self.version, self._config_version)
+        if self._output_key is not None:
+            due = (
+                now is None
+                or self._handled_at is None
+                or now - self._handled_at >= self.cadence
+            )
+            if key == self._output_key or not due:
+                self.cache_hits += 1
+                return self._output
+
+        started = time.perf_counter()
+        if self._streaming:
+            value = self._handler(self._threshold)
+        else:
+            value = self._handler(self._buffer.values, self._threshold)
+        self.handler_duration.observe(time.perf_counter() - started)
+
+        self._output = value if value else 0
+        self._output_key = key
+        self._handled_at = now
+        return self._output
+
     @staticmethod
-    def _handle_trend(df: pd.DataFrame, threshold: float):
-        df_length = len(df.index.tolist())
+    def _handle_trend(values: np.ndarray, threshold: float):
+        length = len(values)
 
-        if df_length < 2:
+        if length < 2:
             return 0
 
-        x_in = list(range(0, df_length, 1))
-        y_in = df["value"].tolist()
+        x_in = list(range(0, length, 1))
+        y_in = values.tolist()
         with warnings.catch_warnings():
             warnings.filterwarnings("ignore", category=UserWarning)
             warnings.filterwarnings("ignore", category=RuntimeWarning)
-            seg = Segmenter(x_in, y_in, n=df_length)
+            seg = Segmenter(x_in, y_in, n=length)
             segments = seg.calculate_segments()
 
         slope = segments[0].slope
@@ -0,0 +1,196 @@
+import os
+import queue
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+import numpy as np
+
+DECISIONS_STREAM = "decisions"
+ACTUATIONS_STREAM = "actuations"
+SAMPLES_PREFIX = "samples_"
+
+
+def stream_name(topic: str) -> str:
+    return SAMPLES_PREFIX + topic.replace("/", "_")
+
+
+class SessionRecorder(object):
+    """Append-only columnar recorder for a whole session.
+
+    Records are handed over through a bounded queue and written by a
+    background thread as numbered ``.npz`` chunks, one directory per stream
+    (``samples_<topic>``, ``decisions`` and ``actuations``). Every chunk
+    holds one array per column. At most ``chunk_size`` rows per stream are
+    kept in memory, and the oldest chunks are deleted once the recording
+    exceeds ``max_bytes``.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        chunk_size: int = 4096,
+        flush_interval: float = 10.0,
+        max_bytes: int = 2 * 1024**3,
+        queue_size: int = 65536,
+    ):
+        self.directory = os.path.join(
+            directory, datetime.now().strftime("%Y%m%d-%H%M%S")
+        )
+        self.chunk_size = chunk_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._columns = {}  # stream -> {column: list}
+        self._rows = {}  # stream -> number of buffered rows
+        self._chunk_numbers = {}
+        self._last_flush = {}
+        self._chunks = deque()  # (path, size) of written chunks, oldest first
+        self._bytes = 0
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="recorder", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _put(self, stream: str, row: dict):
+        try:
+            self._queue.put_nowait((stream, row))
+        except queue.Full:
+            self.dropped += 1
+
+    def record_sample(self, topic: str, timestamp: float, value):
+        self._put(stream_name(topic), {"timestamp": timestamp, "value": value})
+
+    def record_decision(self, timestamp: float, modalities: dict):
+        row = {"timestamp": timestamp}
+        row.update(modalities)
+        self._put(DECISIONS_STREAM, row)
+
+    def record_actuation(
+        self,
+        timestamp: float,
+        modality: str,
+        method: str,
+        url: str,
+        status: str,
+        latency: float,
+    ):
+        self._put(
+            ACTUATIONS_STREAM,
+            {
+                "timestamp": timestamp,
+                "modality": modality,
+                "method": method,
+                "url": url,
+                "status": status,
+                "latency": latency,
+            },
+        )
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                stream, row = self._queue.get(timeout=1.0)
+                self._append(stream, row)
+            except queue.Empty:
+                pass
+            self._flush_due()
+        # drain what is left and write everything on shutdown
+        while True:
+            try:
+                stream, row = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            self._append(stream, row)
+        for stream in list(self._columns):
+            self._flush(stream)
+
+    def _append(self, stream: str, row: dict):
+        columns = self._columns.get(stream)
+        if columns is None:
+            columns = self._columns[stream] = {}
+            self._rows[stream] = 0
+            self._last_flush[stream] = time.monotonic()
+        rows = self._rows[stream]
+        for column, value in row.items():
+            # columns that appear later are padded with None for earlier rows
+            columns.setdefault(column, [None] * rows).append(value)
+        self._rows[stream] = rows + 1
+        for values in columns.values():
+            if len(values) < rows + 1:
+                values.append(None)
+        if self._rows[stream] >= self.chunk_size:
+            self._flush(stream)
+
+    def _flush_due(self):
+        now = time.monotonic()
+        for stream in list(self._columns):
+            if now - self._last_flush[stream] >= self.flush_interval:
+                self._flush(stream)
+
+    def _flush(self, stream: str):
+        self._last_flush[stream] = time.monotonic()
+        if self._rows.get(stream, 0) == 0:
+            return
+        columns = self._columns[stream]
+        self._columns[stream] = {column: [] for column in columns}
+        self._rows[stream] = 0
+
+        number = self._chunk_numbers.get(stream, 0)
+        self._chunk_numbers[stream] = number + 1
+        stream_dir = os.path.join(self.directory, stream)
+        os.makedirs(stream_dir, exist_ok=True)
+        path = os.path.join(stream_dir, "{:06d}.npz".format(number))
+        arrays = {column: _to_array(values) for column, values in columns.items()}
+        try:
+            np.savez(path, **arrays)
+        except OSError as e:
+            print("Could not write recording chunk {}: {}".format(path, e), flush=True)
+            return
+        size = os.path.getsize(path)
+        self._chunks.append((path, size))
+        self._bytes += size
+        self._rotate()
+
+    def _rotate(self):
+        while self._bytes > self.max_bytes and len(self._chunks) > 1:
+            path, size = self._chunks.popleft()
+            self._bytes -= size
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def _to_array(values: list) -> np.ndarray:
+    array = np.asarray(values)
+    if array.dtype == object:
+        # mixed or missing values are stored as strings to avoid pickling
+        array = np.asarray(["" if v is None else str(v) for v in values])
+    return array
+
+
+def load_stream(directory: str, stream: str) -> dict:
+    """Concatenate all chunks of one recorded stream into column arrays."""
+    stream_dir = os.path.join(directory, stream)
+    chunks = sorted(f for f in os.listdir(stream_dir) if f.endswith(".npz"))
+    columns = {}
+    for chunk in chunks:
+        with np.load(os.path.join(stream_dir, chunk)) as data:
+            for column in data.files:
+                columns.setdefault(column, []).append(data[column])
+    return {column: np.concatenate(parts) for column, parts in columns.items()}
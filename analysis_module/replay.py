@@ -0,0 +1,139 @@
+"""Replay a recorded session through the analysis pipeline.
+
+The samples are fed through fresh producers and modalities driven by a
+virtual clock, so the session runs as fast as the CPU allows. Instead of
+calling the robot controller, the resulting actuations are written as an
+NDJSON timeline.
+
+    python3 replay.py <recording directory or samples.ndjson> [--output timeline.ndjson]
+"""
+import argparse
+import contextlib
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from clock import VirtualClock
+from pipeline import ANALYSIS_INTERVAL, Pipeline, create_modalities, create_producers
+from recorder import load_stream, stream_name
+from window import to_epoch_seconds
+
+
+class TimelineDispatcher(object):
+    """Collects actuations instead of sending them to the robot controller."""
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.timeline = []
+
+    def submit(self, name, method, url, body=None, timeout=None):
+        if not isinstance(name, str):
+            name = list(name)  # the modalities of a batched request
+        entry = {"timestamp": self.clock.now(), "modality": name, "method": method, "path": url}
+        if body is not None:
+            entry["body"] = body
+        self.timeline.append(entry)
+        return True
+
+
+def load_recording(directory: str, topics: list):
+    """Load the recorded samples as (times, topics, values), sorted by time."""
+    times, labels, values = [], [], []
+    for topic in topics:
+        if not os.path.isdir(os.path.join(directory, stream_name(topic))):
+            continue
+        columns = load_stream(directory, stream_name(topic))
+        times.append(columns["timestamp"])
+        labels.extend([topic] * len(columns["timestamp"]))
+        values.extend(columns["value"].tolist())
+    if not times:
+        return np.empty(0), [], []
+    times = np.concatenate(times)
+    order = np.argsort(times, kind="stable")
+    return times[order], [labels[i] for i in order], [values[i] for i in order]
+
+
+def load_ndjson(path: str):
+    """Load samples in the /data format, one JSON object per line."""
+    samples = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                sample = json.loads(line)
+                samples.append(
+                    (to_epoch_seconds(sample["timestamp"]), sample["topic"], sample["value"])
+                )
+    samples.sort(key=lambda sample: sample[0])
+    return (
+        np.array([s[0] for s in samples]),
+        [s[1] for s in samples],
+        [s[2] for s in samples],
+    )
+
+
+def replay(times, topics, values, interval: float = ANALYSIS_INTERVAL, config: dict = None):
+    """Feed the samples through a fresh pipeline and return the actuation timeline."""
+    clock = VirtualClock(times[0] if len(times) else 0.0)
+    dispatcher = TimelineDispatcher(clock)
+    pipeline = Pipeline(
+        create_producers(config),
+        create_modalities("", dispatcher, clock=clock, verbose=False, config=config),
+        clock=clock,
+        verbose=False,
+    )
+    start = clock.now()
+    ticks = 0
+    next_tick = start + interval
+    for timestamp, topic, value in zip(times.tolist(), topics, values):
+        # run all analysis ticks that would have happened before this sample
+        while timestamp >= next_tick:
+            clock.advance_to(next_tick)
+            pipeline.analyse()
+            ticks += 1
+            next_tick = start + (ticks + 1) * interval
+        producer = pipeline.producer_map.get(topic, None)
+        if producer:
+            producer.append(timestamp, value)
+    return dispatcher.timeline, ticks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("source", help="recording directory or NDJSON sample file")
+    parser.add_argument("--interval", type=float, default=ANALYSIS_INTERVAL)
+    parser.add_argument("--output", help="timeline file, defaults to stdout")
+    args = parser.parse_args()
+
+    topics = [producer.subscription_topic for producer in create_producers()]
+    if os.path.isdir(args.source):
+        times, labels, values = load_recording(args.source, topics)
+    else:
+        times, labels, values = load_ndjson(args.source)
+
+    started = time.perf_counter()
+    # keep handler output out of the timeline when it is written to stdout
+    with contextlib.redirect_stdout(sys.stderr):
+        timeline, ticks = replay(times, labels, values, args.interval)
+    elapsed = time.perf_counter() - started
+
+    output = open(args.output, "w") if args.output else sys.stdout
+    for entry in timeline:
+        output.write(json.dumps(entry) + "\n")
+    if args.output:
+        output.close()
+
+    duration = times[-1] - times[0] if len(times) else 0.0
+    print(
+        "Replayed {} samples ({:.1f}s session, {} ticks) in {:.2f}s, {} actuations".format(
+            len(times), duration, ticks, elapsed, len(timeline)
+        ),
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
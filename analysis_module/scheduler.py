@@ -0,0 +1,72 @@
+import sched
+import threading
+import time
+from typing import Callable
+
+from metrics import TICK_BUCKETS, Histogram
+
+
+class AnalysisScheduler(object):
+    """Runs a task at a fixed interval on a dedicated thread.
+
+    Ticks are scheduled on absolute deadlines (start + n * interval), so the
+    time spent inside the task does not accumulate as drift. If a tick runs
+    past one or more deadlines, the missed ticks are skipped and counted as
+    overruns instead of being executed back to back.
+    """
+
+    def __init__(self, interval: float, task: Callable, name: str = "analysis"):
+        self.interval = interval
+        self.task = task
+        self.name = name
+        self.ticks = 0
+        self.overruns = 0
+        self.last_duration = 0.0
+        self.tick_duration = Histogram(TICK_BUCKETS)
+        self._scheduler = sched.scheduler(time.monotonic, time.sleep)
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        self._scheduler.enterabs(time.monotonic(), 1, self._tick, (time.monotonic(),))
+        while not self._stopped.is_set():
+            self._scheduler.run()
+
+    def _tick(self, deadline: float):
+        if self._stopped.is_set():
+            return
+        started = time.monotonic()
+        try:
+            self.task()
+        except Exception as e:
+            print("{} tick failed: {}".format(self.name, e), flush=True)
+        finished = time.monotonic()
+        self.ticks += 1
+        self.last_duration = finished - started
+        self.tick_duration.observe(self.last_duration)
+
+        next_deadline = deadline + self.interval
+        if finished > next_deadline:
+            missed = int((finished - deadline) // self.interval)
+            self.overruns += missed
+            print(
+                "{} tick overran by {:.3f}s, skipping {} tick(s)".format(
+                    self.name, finished - next_deadline, missed
+                ),
+                flush=True,
+            )
+            next_deadline = deadline + (missed + 1) * self.interval
+        self._scheduler.enterabs(next_deadline, 1, self._tick, (next_deadline,))
@@ -0,0 +1,22 @@
+"""Production entry point, serving the analysis module with waitress.
+
+Unlike the Flask development server started by app.py, waitress handles the
+requests from a fixed pool of threads. Every open /stream connection keeps
+one of them busy, so SERVER_THREADS has to leave room for the dashboards.
+
+    python3 serve.py
+"""
+import os
+
+from waitress import serve
+
+import app
+
+HOST = os.getenv("SERVER_HOST", "0.0.0.0")
+PORT = int(os.getenv("SERVER_PORT", "5000"))
+THREADS = int(os.getenv("SERVER_THREADS", "16"))
+
+if __name__ == "__main__":
+    app.bootstrap_parameters()
+    app.start_background()
+    serve(app.app, host=HOST, port=PORT, threads=THREADS)
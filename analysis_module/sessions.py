@@ -0,0 +1,537 @@
+import itertools
+import multiprocessing
+import os
+import threading
+import time
+import zlib
+
+from dispatcher import ActuationDispatcher
+from metrics import MetricsWriter, collect as collect_metrics
+from pipeline import (
+    ANALYSIS_INTERVAL,
+    DEFAULT_CONFIG_PATH,
+    Pipeline,
+    create_modalities,
+    create_producers,
+    load_config,
+)
+from recorder import SessionRecorder
+from scheduler import AnalysisScheduler
+
+DEFAULT_SESSION = "default"
+INGEST_CHUNK_SIZE = 1000  # samples per message to a worker process
+CONFIG_CHECK_INTERVAL = 1.0  # seconds between checks of the config file
+
+
+class SessionNotFound(KeyError):
+    pass
+
+
+class Session(object):
+    """Producers, modalities and actuation state of one robot cell."""
+
+    def __init__(
+        self,
+        session_id: str,
+        robot_url: str,
+        publish=None,
+        config: dict = None,
+        recording_dir: str = None,
+        recording_max_bytes: int = 2 * 1024**3,
+        verbose: bool = True,
+    ):
+        self.id = session_id
+        self.robot_url = robot_url
+        self.recorder = (
+            SessionRecorder(
+                os.path.join(recording_dir, session_id), max_bytes=recording_max_bytes
+            )
+            if recording_dir
+            else None
+        )
+        self.dispatcher = ActuationDispatcher()
+        self.dispatcher.recorder = self.recorder
+        self.verbose = verbose
+        self.pipeline = Pipeline(
+            create_producers(config),
+            create_modalities(robot_url, self.dispatcher, verbose=verbose, config=config),
+            recorder=self.recorder,
+            verbose=verbose,
+        )
+        self.config_version = 0  # incremented whenever the pipeline is reconfigured
+        self.streaming = False  # whether anyone listens to the event stream
+        self._publish = publish
+        self._published_versions = {}  # producer versions already pushed to the stream
+        # compile/apply of the pipeline and the version bump happen together
+        self._config_lock = threading.Lock()
+
+    def start(self):
+        if self.recorder:
+            self.recorder.start()
+
+    def stop(self):
+        if self.recorder:
+            self.recorder.stop()
+
+    def info(self):
+        return {"session": self.id, "robot_url": self.robot_url}
+
+    def set_streaming(self, streaming: bool):
+        self.streaming = streaming
+
+    def publish(self, event: str, data):
+        if self._publish and self.streaming:
+            self._publish(self.id, event, data)
+
+    def get_influences(self):
+        return self.pipeline.get_influences()
+
+    def apply_config(self, config: dict):
+        """Replace the producers and modalities with the ones of ``config``."""
+        # everything is built before the swap, so an invalid config changes nothing
+        self.swap_config(*self.build_config(config))
+
+    def build_config(self, config: dict) -> tuple:
+        """Producers and modalities of ``config``; raises if it is invalid."""
+        producers = create_producers(config)
+        modalities = create_modalities(
+            self.robot_url, self.dispatcher, verbose=self.verbose, config=config
+        )
+        return producers, modalities
+
+    def swap_config(self, producers: list, modalities: list):
+        with self._config_lock:
+            self.pipeline.apply(producers, modalities)
+            self.config_version += 1
+        self.publish("influences", self.get_influences())
+
+    def analyse(self):
+        modalities, decisions = self.pipeline.analyse()
+        if self.streaming:
+            self.publish_samples()
+            self.publish("decision", {"modalities": modalities, "decisions": decisions})
+        else:
+            for producer in self.pipeline.producers:
+                self._published_versions[producer.subscription_topic] = producer.version
+
+    def publish_samples(self):
+        """Push the samples that arrived since the last tick to the stream."""
+        samples = {}
+        for producer in self.pipeline.producers:
+            topic = producer.subscription_topic
+            version = producer.version
+            published = self._published_versions.get(topic, 0)
+            if version != published:
+                times, values = producer.samples_since(published)
+                samples[topic] = {
+                    "t": [round(t * 1000) for t in times.tolist()],
+                    "v": values.tolist(),
+                }
+            self._published_versions[topic] = version
+        if samples:
+            self.publish("samples", samples)
+
+    def add_sample(self, sample: dict) -> bool:
+        producer = self.pipeline.producer_map.get(sample.get("topic"), None)
+        if producer is None:
+            return False
+        producer.add_data(sample)
+        return True
+
+    def ingest(self, samples) -> dict:
+        accepted = {}
+        rejected = 0
+        for sample in samples:
+            try:
+                producer = self.pipeline.producer_map.get(sample["topic"], None)
+                if producer is None:
+                    rejected += 1
+                    continue
+                producer.add_data(sample)
+            except (KeyError, TypeError, ValueError):
+                rejected += 1
+                continue
+            accepted[producer.subscription_topic] = (
+                accepted.get(producer.subscription_topic, 0) + 1
+            )
+        return {"accepted": accepted, "rejected": rejected}
+
+    def data_etag(self) -> str:
+        versions = [str(self.config_version)] + [
+            str(p.version) for p in self.pipeline.producers
+        ]
+        return "-".join(versions)
+
+    def data(self, since: float = None, etags: list = ()):
+        """The ETag and the producer windows, or None if the client is up to date.
+
+        ``since`` is in epoch milliseconds and only returns the samples after it.
+        """
+        etag = self.data_etag()
+        if since is None and etag in etags:
+            return etag, None
+        producers = self.pipeline.producers
+        snapshot = {
+            p.subscription_topic: p.snapshot(since / 1000 if since is not None else None)
+            for p in producers
+        }
+        snapshot["influences"] = self.get_influences()
+        last_times = [t for t in (p.last_time for p in producers) if t is not None]
+        snapshot["until"] = round(max(last_times) * 1000) if last_times else since
+        return etag, snapshot
+
+    def producers(self):
+        return [
+            {
+                "subscription_topic": p.subscription_topic,
+                "analysis_interval": p._analysis_interval,
+                "threshold": p._threshold,
+                "output_modalities": p.output_modalities,
+                "cadence": p.cadence,
+            }
+            for p in self.pipeline.producers
+        ]
+
+    def update_producer(self, data: dict) -> bool:
+        with self._config_lock:
+            producer = self.pipeline.producer_map.get(data["subscription_topic"], None)
+            if not producer:
+                return False
+            # only update the values that are in the request
+            producer.configure(
+                analysis_interval=data.get("analysis_interval"),
+                threshold=data.get("threshold"),
+                output_modalities=data.get("output_modalities"),
+                cadence=data.get("cadence"),
+            )
+            self.pipeline.compile()
+            self.config_version += 1
+        self.publish("influences", self.get_influences())
+        return True
+
+    def modalities(self):
+        return [
+            {
+                "name": m.name,
+                "threshold": m.threshold,
+                "cooldown_duration": m.cooldown_duration,
+                "actuation": self.dispatcher.stats(m.name),
+            }
+            for m in self.pipeline.modalities
+        ]
+
+    def update_modality(self, data: dict) -> bool:
+        with self._config_lock:
+            modality = self.pipeline.modality_map.get(data["name"], None)
+            if not modality:
+                return False
+            # only update the values that are in the request
+            if "threshold" in data:
+                modality.threshold = data["threshold"]
+            if "cooldown_duration" in data:
+                modality.cooldown_duration = data["cooldown_duration"]
+            self.pipeline.compile()
+            self.config_version += 1
+        return True
+
+    def collect_metrics(self, out: MetricsWriter):
+        collect_metrics(
+            out,
+            self.pipeline.producers,
+            self.pipeline.modalities,
+            dispatcher=self.dispatcher,
+            labels={"session": self.id},
+        )
+
+
+class SessionShard(object):
+    """Sessions analysed by one scheduler, either in-process or in a worker."""
+
+    def __init__(
+        self,
+        name: str = "analysis",
+        publish=None,
+        config_path: str = None,
+        **session_options,
+    ):
+        self.name = name
+        self.sessions = {}
+        self.scheduler = AnalysisScheduler(ANALYSIS_INTERVAL, self.analyse, name=name)
+        self.config_path = config_path or DEFAULT_CONFIG_PATH
+        self.config = load_config(self.config_path)
+        self._config_mtime = os.path.getmtime(self.config_path)
+        self._config_checked = time.monotonic()
+        self._publish = publish
+        self._session_options = session_options
+        self._started = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        self._started = True
+        for session in list(self.sessions.values()):
+            session.start()
+        self.scheduler.start()
+
+    def stop(self):
+        self.scheduler.stop()
+        for session in list(self.sessions.values()):
+            session.stop()
+
+    def reload_config(self):
+        """Apply the config file to all sessions if it changed on disk."""
+        now = time.monotonic()
+        if now - self._config_checked < CONFIG_CHECK_INTERVAL:
+            return
+        self._config_checked = now
+        # held throughout, so sessions created meanwhile get the new config
+        with self._lock:
+            try:
+                mtime = os.path.getmtime(self.config_path)
+                if mtime == self._config_mtime:
+                    return
+                self._config_mtime = mtime
+                config = load_config(self.config_path)
+                # all sessions are built before any is changed, so an invalid
+                # config leaves every session on the previous one
+                built = [
+                    (session, session.build_config(config))
+                    for session in self.sessions.values()
+                ]
+            except (OSError, ValueError, TypeError, KeyError) as e:
+                print("Could not reload {}: {}".format(self.config_path, e), flush=True)
+                return
+            for session, (producers, modalities) in built:
+                session.swap_config(producers, modalities)
+            self.config = config
+        print("Reloaded pipeline config {}".format(self.config_path), flush=True)
+
+    def analyse(self):
+        self.reload_config()
+        for session in list(self.sessions.values()):
+            try:
+                session.analyse()
+            except Exception as e:
+                print("analysis of session {} failed: {}".format(session.id, e), flush=True)
+
+    def create(self, session_id: str, robot_url: str) -> bool:
+        with self._lock:
+            if session_id in self.sessions:
+                return False
+            session = Session(
+                session_id,
+                robot_url,
+                self._publish,
+                self.config,
+                **self._session_options,
+            )
+            self.sessions[session_id] = session
+        if self._started:
+            session.start()
+        return True
+
+    def list(self):
+        return [session.info() for session in list(self.sessions.values())]
+
+    def call(self, session_id: str, method: str, args: tuple = ()):
+        session = self.sessions.get(session_id, None)
+        if session is None:
+            raise SessionNotFound(session_id)
+        return getattr(session, method)(*args)
+
+    def metrics(self) -> dict:
+        out = MetricsWriter()
+        collect_metrics(out, scheduler=self.scheduler, labels={"worker": self.name})
+        for session in list(self.sessions.values()):
+            session.collect_metrics(out)
+        return out.families
+
+
+class LocalSessions(object):
+    """All sessions in the serving process, analysed by one scheduler."""
+
+    def __init__(self, publish=None, **session_options):
+        self.shard = SessionShard(publish=publish, **session_options)
+
+    def start(self):
+        self.shard.start()
+
+    def create(self, session_id: str, robot_url: str) -> bool:
+        return self.shard.create(session_id, robot_url)
+
+    def list(self):
+        return self.shard.list()
+
+    def call(self, session_id: str, method: str, *args):
+        return self.shard.call(session_id, method, args)
+
+    def send(self, session_id: str, method: str, *args):
+        try:
+            self.shard.call(session_id, method, args)
+        except SessionNotFound:
+            pass
+
+    def ingest(self, session_id: str, samples) -> dict:
+        return self.shard.call(session_id, "ingest", (samples,))
+
+    def metrics(self) -> str:
+        out = MetricsWriter()
+        out.merge(self.shard.metrics())
+        return out.render()
+
+
+class ShardedSessions(object):
+    """Sessions spread over worker processes by a stable hash of their id.
+
+    Every worker owns its sessions and runs its own analysis scheduler, so
+    the cells scale across cores. The serving process only forwards calls
+    through one inbox queue per worker; replies and stream events come back
+    through a shared outbox and are picked up by a reader thread.
+    """
+
+    def __init__(self, workers: int, publish=None, timeout: float = 5.0, **session_options):
+        self.workers = workers
+        self.timeout = timeout
+        self._publish = publish
+        self._session_options = session_options
+        self._inboxes = []
+        self._outbox = None
+        self._processes = []
+        self._pending = {}  # request id -> [threading.Event, result]
+        self._pending_lock = threading.Lock()
+        self._request_ids = itertools.count()
+        self._sessions = {}  # session id -> robot url, to create them once started
+
+    def start(self):
+        if self._processes:
+            return
+        # spawn instead of fork, the serving process already runs threads
+        context = multiprocessing.get_context("spawn")
+        self._outbox = context.Queue()
+        for index in range(self.workers):
+            inbox = context.Queue()
+            process = context.Process(
+                target=_run_shard,
+                args=(index, inbox, self._outbox, self._session_options),
+                name="analysis-{}".format(index),
+                daemon=True,
+            )
+            process.start()
+            self._inboxes.append(inbox)
+            self._processes.append(process)
+        threading.Thread(target=self._read, name="session-replies", daemon=True).start()
+        for session_id, robot_url in self._sessions.items():
+            self._request(self._shard(session_id), "create", session_id, robot_url)
+
+    def _shard(self, session_id: str) -> int:
+        return zlib.crc32(session_id.encode()) % self.workers
+
+    def _request(self, shard: int, kind: str, *args, reply: bool = True):
+        if not reply:
+            self._inboxes[shard].put((None, kind) + args)
+            return None
+        request_id = next(self._request_ids)
+        waiter = [threading.Event(), None]
+        with self._pending_lock:
+            self._pending[request_id] = waiter
+        self._inboxes[shard].put((request_id, kind) + args)
+        try:
+            if not waiter[0].wait(self.timeout):
+                raise TimeoutError("analysis worker {} did not reply".format(shard))
+        finally:
+            with self._pending_lock:
+                self._pending.pop(request_id, None)
+        if isinstance(waiter[1], Exception):
+            raise waiter[1]
+        return waiter[1]
+
+    def _read(self):
+        while True:
+            message = self._outbox.get()
+            if message[0] == "reply":
+                _, request_id, result = message
+                with self._pending_lock:
+                    waiter = self._pending.get(request_id, None)
+                if waiter:
+                    waiter[1] = result
+                    waiter[0].set()
+            elif message[0] == "event" and self._publish:
+                _, session_id, event, data = message
+                self._publish(session_id, event, data)
+
+    def create(self, session_id: str, robot_url: str) -> bool:
+        if not self._processes:
+            # created on the workers when they are started
+            if session_id in self._sessions:
+                return False
+            self._sessions[session_id] = robot_url
+            return True
+        return self._request(self._shard(session_id), "create", session_id, robot_url)
+
+    def list(self):
+        sessions = []
+        for shard in range(self.workers):
+            sessions.extend(self._request(shard, "list"))
+        return sessions
+
+    def call(self, session_id: str, method: str, *args):
+        return self._request(self._shard(session_id), "call", session_id, method, args)
+
+    def send(self, session_id: str, method: str, *args):
+        """Like call, but without waiting for the result."""
+        self._request(
+            self._shard(session_id), "call", session_id, method, args, reply=False
+        )
+
+    def ingest(self, session_id: str, samples) -> dict:
+        # large batches are forwarded in chunks instead of one huge message
+        result = {"accepted": {}, "rejected": 0}
+        for chunk in _chunks(samples, INGEST_CHUNK_SIZE):
+            counts = self.call(session_id, "ingest", chunk)
+            for topic, count in counts["accepted"].items():
+                result["accepted"][topic] = result["accepted"].get(topic, 0) + count
+            result["rejected"] += counts["rejected"]
+        return result
+
+    def metrics(self) -> str:
+        out = MetricsWriter()
+        for shard in range(self.workers):
+            out.merge(self._request(shard, "metrics"))
+        return out.render()
+
+
+def _chunks(samples, size: int):
+    chunk = []
+    for sample in samples:
+        chunk.append(sample)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _run_shard(index: int, inbox, outbox, session_options: dict):
+    """Main loop of a worker process, answering the calls from the inbox."""
+
+    def publish(session_id, event, data):
+        outbox.put(("event", session_id, event, data))
+
+    shard = SessionShard("analysis-{}".format(index), publish, **session_options)
+    shard.start()
+    while True:
+        message = inbox.get()
+        if message is None:
+            break
+        request_id, kind, args = message[0], message[1], message[2:]
+        try:
+            if kind == "call":
+                result = shard.call(*args)
+            else:
+                result = getattr(shard, kind)(*args)
+        except Exception as e:
+            result = e
+            if request_id is None:
+                print("session call {} failed: {}".format(args[:2], e), flush=True)
+        if request_id is not None:
+            outbox.put(("reply", request_id, result))
+    shard.stop()
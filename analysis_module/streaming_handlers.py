@@ -0,0 +1,453 @@
+from collections import deque
+
+import numpy as np
+
+# in the order of DeepFace's emotion probabilities, the index is the stored code
+EXPRESSIONS = ("angry", "disgust", "fear", "happy", "sad", "surprise", "neutral")
+EXPRESSION_SCORES = (-1, -1, -1, 1, -1, -1, 0)
+_EXPRESSION_CODES = {expression: code for code, expression in enumerate(EXPRESSIONS)}
+_SCORE_TABLE = np.array(EXPRESSION_SCORES)
+
+
+class StreamingHandler(object):
+    """Base class for handlers that update their state per sample.
+
+    The producer calls ``add`` for every appended sample and ``evict`` with
+    the values that left the window, so ``__call__`` can answer in constant
+    time instead of rescanning the window on every analysis tick.
+    """
+
+    # set by handlers whose running state should be rebuilt from the window
+    stale = False
+    @staticmethod
+    def encode(value):
+        """Convert an incoming value into what the window stores and ``add`` gets."""
+        return float(value)
+
+    def add(self, value):
+        raise NotImplementedError
+
+    def evict(self, values: np.ndarray):
+        raise NotImplementedError
+
+    def reset(self, values: np.ndarray):
+        raise NotImplementedError
+
+    def __call__(self, threshold: float):
+        raise NotImplementedError
+
+
+class OnlineTrend(StreamingHandler):
+    """Least-squares slope over the window from running sums.
+
+    Equivalent to fitting a line through (sample index, value) like
+    ``Producer._handle_trend`` does with the Segmenter, including the
+    5 x threshold outlier cut-off.
+    """
+
+    # rebuild the sums from the window regularly to bound floating point drift
+    REBASE_INTERVAL = 2**16
+
+    def __init__(self):
+        self.reset(np.empty(0))
+
+    def reset(self, values: np.ndarray):
+        self._n = 0
+        self._first = 0  # x of the oldest sample in the window
+        self._next = 0  # x of the next sample
+        self._sum_x = 0.0
+        self._sum_y = 0.0
+        self._sum_xy = 0.0
+        self._sum_xx = 0.0
+        self.stale = False
+        for value in values:
+            self.add(value)
+
+    def add(self, value):
+        x = self._next
+        y = float(value)
+        self._next += 1
+        self._n += 1
+        self._sum_x += x
+        self._sum_y += y
+        self._sum_xy += x * y
+        self._sum_xx += x * x
+        if self._next >= self.REBASE_INTERVAL:
+            self.stale = True
+
+    def evict(self, values: np.ndarray):
+        for value in values:
+            x = self._first
+            y = float(value)
+            self._first += 1
+            self._n -= 1
+            self._sum_x -= x
+            self._sum_y -= y
+            self._sum_xy -= x * y
+            self._sum_xx -= x * x
+
+    @property
+    def slope(self):
+        if self._n < 2:
+            return 0.0
+        denominator = self._n * self._sum_xx - self._sum_x * self._sum_x
+        if denominator == 0:
+            return 0.0
+        return (self._n * self._sum_xy - self._sum_x * self._sum_y) / denominator
+
+    def __call__(self, threshold: float):
+        if self._n < 2:
+            return 0
+
+        slope = self.slope
+        if slope > (5 * threshold) or slope < (-5 * threshold):
+            return 0
+        if slope > threshold:
+            return 1
+        elif slope < -threshold:
+            return -1
+        else:
+            return 0
+
+
+def _sign(value: float) -> int:
+    return 1 if value > 0 else -1
+
+
+class EwmaDeviation(StreamingHandler):
+    """Deviation of the newest sample from an exponentially weighted baseline.
+
+    Mean and variance are exponentially weighted with ``alpha``, so the
+    baseline adapts slowly instead of following the window. The result is
+    +1/-1 while the newest sample lies more than ``threshold`` standard
+    deviations above/below the baseline it was compared against.
+    """
+
+    def __init__(self, alpha: float = 0.05, warmup: int = 10):
+        self.alpha = alpha
+        self.warmup = warmup
+        self.reset(np.empty(0))
+
+    def reset(self, values: np.ndarray):
+        self._n = 0
+        self._mean = 0.0
+        self._var = 0.0
+        self._deviation = 0.0
+        for value in values:
+            self.add(value)
+
+    def add(self, value):
+        x = float(value)
+        if not np.isfinite(x):
+            return
+        self._n += 1
+        if self._n == 1:
+            self._mean = x
+            return
+        diff = x - self._mean
+        std = self._var**0.5
+        self._deviation = diff / std if std > 0 else 0.0
+        # plain running mean and variance until 1 / alpha samples were seen
+        alpha = max(self.alpha, 1.0 / self._n)
+        increment = alpha * diff
+        self._mean += increment
+        self._var = (1 - alpha) * (self._var + diff * increment)
+
+    def evict(self, values: np.ndarray):
+        # the baseline forgets exponentially, not with the window
+        pass
+
+    def __call__(self, threshold: float):
+        if self._n <= self.warmup or abs(self._deviation) <= threshold:
+            return 0
+        return _sign(self._deviation)
+
+
+class RollingZScore(StreamingHandler):
+    """z-score of the newest sample against the mean and deviation of the window.
+
+    Sums are kept relative to the first sample after a reset to limit
+    cancellation, and rebuilt from the window every ``REBASE_INTERVAL``
+    samples.
+    """
+
+    REBASE_INTERVAL = 2**16
+
+    def __init__(self, min_samples: int = 10):
+        self.min_samples = min_samples
+        self.reset(np.empty(0))
+
+    def reset(self, values: np.ndarray):
+        self._n = 0
+        self._added = 0
+        self._shift = None
+        self._sum = 0.0
+        self._sum_sq = 0.0
+        self._last = 0.0
+        self.stale = False
+        for value in values:
+            self.add(value)
+
+    def add(self, value):
+        x = float(value)
+        if not np.isfinite(x):
+            return
+        if self._shift is None:
+            self._shift = x
+        x -= self._shift
+        self._n += 1
+        self._sum += x
+        self._sum_sq += x * x
+        self._last = x
+        self._added += 1
+        if self._added >= self.REBASE_INTERVAL:
+            self.stale = True
+
+    def evict(self, values: np.ndarray):
+        for value in values:
+            x = float(value)
+            if not np.isfinite(x):
+                continue
+            x -= self._shift
+            self._n -= 1
+            self._sum -= x
+            self._sum_sq -= x * x
+
+    @property
+    def zscore(self) -> float:
+        if self._n < 2:
+            return 0.0
+        mean = self._sum / self._n
+        var = max(self._sum_sq / self._n - mean * mean, 0.0)
+        if var == 0:
+            return 0.0
+        return (self._last - mean) / var**0.5
+
+    def __call__(self, threshold: float):
+        if self._n < self.min_samples:
+            return 0
+        zscore = self.zscore
+        if abs(zscore) <= threshold:
+            return 0
+        return _sign(zscore)
+
+
+class Cusum(StreamingHandler):
+    """Two-sided CUSUM on samples standardised by a slow exponential baseline.
+
+    Deviations beyond ``drift`` standard deviations accumulate until one of
+    the sums exceeds ``threshold``. Reporting a change re-arms the detector.
+    """
+
+    def __init__(self, drift: float = 0.5, alpha: float = 0.01, warmup: int = 10):
+        self.drift = drift
+        self.baseline = EwmaDeviation(alpha, warmup)
+        self.reset(np.empty(0))
+
+    def reset(self, values: np.ndarray):
+        self.baseline.reset(np.empty(0))
+        self._high = 0.0
+        self._low = 0.0
+        for value in values:
+            self.add(value)
+
+    def add(self, value):
+        x = float(value)
+        if not np.isfinite(x):
+            return
+        baseline = self.baseline
+        if baseline._n > baseline.warmup and baseline._var > 0:
+            z = (x - baseline._mean) / baseline._var**0.5
+            self._high = max(0.0, self._high + z - self.drift)
+            self._low = max(0.0, self._low - z - self.drift)
+        baseline.add(x)
+
+    def evict(self, values: np.ndarray):
+        pass
+
+    def __call__(self, threshold: float):
+        if self._high > threshold:
+            self._high = self._low = 0.0
+            return 1
+        if self._low > threshold:
+            self._high = self._low = 0.0
+            return -1
+        return 0
+
+
+class PageHinkley(StreamingHandler):
+    """Two-sided Page-Hinkley test for a shift of the mean.
+
+    Accumulates the deviations from the running mean minus the tolerated
+    ``delta``; a change is reported once the accumulation rose (or fell)
+    more than ``threshold``, in signal units, above its minimum (below its
+    maximum). Reporting a change re-arms the detector.
+    """
+
+    def __init__(self, delta: float = 0.0, min_samples: int = 10):
+        self.delta = delta
+        self.min_samples = min_samples
+        self.reset(np.empty(0))
+
+    def reset(self, values: np.ndarray):
+        self._n = 0
+        self._mean = 0.0
+        self._up = 0.0
+        self._up_min = 0.0
+        self._down = 0.0
+        self._down_max = 0.0
+        for value in values:
+            self.add(value)
+
+    def add(self, value):
+        x = float(value)
+        if not np.isfinite(x):
+            return
+        self._n += 1
+        self._mean += (x - self._mean) / self._n
+        self._up += x - self._mean - self.delta
+        self._up_min = min(self._up_min, self._up)
+        self._down += x - self._mean + self.delta
+        self._down_max = max(self._down_max, self._down)
+
+    def evict(self, values: np.ndarray):
+        pass
+
+    def __call__(self, threshold: float):
+        if self._n < self.min_samples:
+            return 0
+        if self._up - self._up_min > threshold:
+            self.reset(np.empty(0))
+            return 1
+        if self._down_max - self._down > threshold:
+            self.reset(np.empty(0))
+            return -1
+        return 0
+
+
+class SpikeDetector(StreamingHandler):
+    """Incremental version of ``find_spikes``.
+
+    A sample (or a plateau of equal samples) is a positive peak once both
+    of its neighbours are known and lower, like in ``scipy.signal.find_peaks``.
+    Its margin is the smaller height difference to the two neighbours (zero
+    for plateaus, whose middle is compared with equal samples), and
+    the peak counts as a spike if the margin reaches the threshold. Peaks
+    stay in the window until their left neighbour is evicted. A monotonic
+    deque of the margins answers the largest margin in the window in
+    constant time, so a changed threshold needs no rescan. Negative peaks
+    are handled the same way on the negated signal.
+
+    The ``distance`` filter of ``find_peaks`` only removes the lower of two
+    close peaks and never the highest, so it cannot change whether a spike
+    exists and is accepted for compatibility only.
+    """
+
+    def __init__(self, distance: int = 2, verbose: bool = True):
+        self.distance = distance
+        self.verbose = verbose
+        self.reset(np.empty(0))
+
+    def reset(self, values: np.ndarray):
+        self._first = 0  # index of the oldest sample in the window
+        self._next = 0  # index of the next sample
+        self._before = None  # value left of the current run of equal values
+        self._run_value = None
+        self._run_start = 0
+        # (index of the left neighbour, margin), margins decreasing
+        self._positive = deque()
+        self._negative = deque()
+        for value in values:
+            self.add(value)
+
+    @staticmethod
+    def _push(peaks: deque, left: int, margin: float):
+        while peaks and peaks[-1][1] <= margin:
+            peaks.pop()
+        peaks.append((left, margin))
+
+    def add(self, value):
+        x = float(value)
+        index = self._next
+        self._next += 1
+        if x == self._run_value:
+            return
+        before, run = self._before, self._run_value
+        left = self._run_start - 1
+        if before is not None and left >= self._first:
+            # find_peaks compares a plateau's middle with its equal neighbours
+            plateau = index - self._run_start > 1
+            if before < run and x < run:
+                margin = 0.0 if plateau else min(run - before, run - x)
+                self._push(self._positive, left, margin)
+            elif before > run and x > run:
+                margin = 0.0 if plateau else min(before - run, x - run)
+                self._push(self._negative, left, margin)
+        self._before = run
+        self._run_value = x
+        self._run_start = index
+
+    def evict(self, values: np.ndarray):
+        self._first += len(values)
+        for peaks in (self._positive, self._negative):
+            while peaks and peaks[0][0] < self._first:
+                peaks.popleft()
+
+    def __call__(self, threshold: float):
+        positive = bool(self._positive) and self._positive[0][1] >= threshold
+        negative = bool(self._negative) and self._negative[0][1] >= threshold
+        if positive and negative:
+            return 0
+        elif positive:
+            if self.verbose:
+                print("positive spike", flush=True)
+            return 1
+        elif negative:
+            if self.verbose:
+                print("negative spike", flush=True)
+            return -1
+        return 0
+
+
+class ExpressionTally(StreamingHandler):
+    """Running score of the expressions in the window, like ``handle_expression``.
+
+    A sample is either an expression label or the emotion probabilities
+    returned by DeepFace (label -> probability or percentage), which count
+    as their dominant expression. The window stores the code of the
+    expression, the tally adds its score and subtracts it again on eviction.
+    """
+
+    def __init__(self):
+        self.reset(np.empty(0, dtype=np.int8))
+
+    def reset(self, values: np.ndarray):
+        self._sum = int(_SCORE_TABLE[values.astype(np.intp)].sum())
+
+    @staticmethod
+    def encode(value) -> int:
+        if isinstance(value, dict):
+            unknown = [label for label in value if label not in _EXPRESSION_CODES]
+            if unknown or not value:
+                raise ValueError("Unknown expressions: {}".format(unknown))
+            probabilities = {label: float(p) for label, p in value.items()}
+            value = max(probabilities, key=probabilities.get)
+        if isinstance(value, str):
+            if value not in _EXPRESSION_CODES:
+                raise ValueError("Unknown expression: {}".format(value))
+            return _EXPRESSION_CODES[value]
+        code = int(value)
+        if not 0 <= code < len(EXPRESSIONS):
+            raise ValueError("Unknown expression code: {}".format(code))
+        return code
+
+    def add(self, code):
+        self._sum += EXPRESSION_SCORES[code]
+
+    def evict(self, values: np.ndarray):
+        self._sum -= int(_SCORE_TABLE[values.astype(np.intp)].sum())
+
+    def __call__(self, threshold: float):
+        if self._sum < threshold:
+            return 1
+        return 0
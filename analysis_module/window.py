@@ -0,0 +1,118 @@
+import numpy as np
+import pandas as pd
+
+from datetime import datetime, timezone
+
+
+def to_epoch_seconds(timestamp) -> float:
+    """Convert an incoming sample timestamp to epoch seconds.
+
+    Integers are epoch nanoseconds (binary encoding), floats epoch seconds.
+    Naive timestamps are interpreted as UTC, which is also how pandas
+    serialises a naive DatetimeIndex, so the dashboard keeps seeing the same
+    times as before.
+    """
+    if isinstance(timestamp, int):
+        return timestamp / 1e9
+    if isinstance(timestamp, float):
+        return timestamp
+    if isinstance(timestamp, str):
+        timestamp = datetime.fromisoformat(timestamp)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp.timestamp()
+
+
+class RingBuffer(object):
+    """Fixed-capacity time/value window backed by preallocated numpy arrays.
+
+    Every sample is written twice, at ``i`` and ``i + capacity``, so the
+    window is always available as one contiguous slice and ``times`` and
+    ``values`` are views instead of copies.
+    """
+
+    def __init__(self, capacity: int = 4096, dtype=np.float64):
+        if capacity < 1:
+            raise ValueError("Capacity must be at least 1")
+        self.capacity = capacity
+        self._times = np.zeros(2 * capacity, dtype=np.float64)
+        self._values = np.zeros(2 * capacity, dtype=dtype)
+        self._start = 0
+        self._length = 0
+        self.total = 0  # number of samples ever appended
+
+    def __len__(self):
+        return self._length
+
+    @property
+    def times(self) -> np.ndarray:
+        return self._times[self._start : self._start + self._length]
+
+    @property
+    def values(self) -> np.ndarray:
+        return self._values[self._start : self._start + self._length]
+
+    @property
+    def last_time(self):
+        if self._length == 0:
+            return None
+        return self._times[self._start + self._length - 1]
+
+    def append(self, timestamp: float, value):
+        """Append a sample, overwriting the oldest one if the buffer is full.
+
+        Returns the number of samples that had to be dropped (0 or 1).
+        """
+        dropped = 0
+        if self._length == self.capacity:
+            self._start = (self._start + 1) % self.capacity
+            self._length -= 1
+            dropped = 1
+        index = (self._start + self._length) % self.capacity
+        self._times[index] = timestamp
+        self._times[index + self.capacity] = timestamp
+        self._values[index] = value
+        self._values[index + self.capacity] = value
+        self._length += 1
+        self.total += 1
+        return dropped
+
+    def tail(self, count: int):
+        """Times and values of the newest ``count`` samples still in the window."""
+        count = min(count, self._length)
+        end = self._start + self._length
+        return self._times[end - count : end], self._values[end - count : end]
+
+    def evict_before(self, cutoff: float):
+        """Drop all samples with a timestamp less than or equal to ``cutoff``.
+
+        Returns the evicted values as a view, valid until the next append.
+        """
+        count = int(np.searchsorted(self.times, cutoff, side="right"))
+        return self.evict(count)
+
+    def evict(self, count: int):
+        count = min(count, self._length)
+        evicted = self._values[self._start : self._start + count]
+        self._start = (self._start + count) % self.capacity
+        self._length -= count
+        return evicted
+
+    def clear(self):
+        self._start = 0
+        self._length = 0
+
+    def to_frame(self, since: float = None) -> pd.DataFrame:
+        """Build a DataFrame of the window, optionally only of samples after ``since``."""
+        times, values = self.times, self.values
+        if since is not None:
+            start = int(np.searchsorted(times, since, side="right"))
+            times, values = times[start:], values[start:]
+        return pd.DataFrame(
+            {"value": values.copy()},
+            # round to microseconds to drop the float representation error
+            index=pd.DatetimeIndex(
+                pd.to_datetime(np.round(times * 1e6).astype(np.int64), unit="us"),
+                name="timestamp",
+            ),
+        )
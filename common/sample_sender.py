@@ -0,0 +1,47 @@
+"""Posts samples of the processors to the analysis module.
+
+All timestamps are UTC. Aware datetimes are converted, naive ones are taken
+as UTC like the analysis module does, so processors sending msgpack and
+JSON agree on the time of a sample on any host.
+"""
+import uuid
+from datetime import datetime, timezone
+
+import msgpack
+import requests
+
+MSGPACK_CONTENT_TYPE = "application/msgpack"
+
+
+def utc_now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def to_utc(timestamp: datetime) -> datetime:
+    if timestamp.tzinfo is None:
+        return timestamp.replace(tzinfo=timezone.utc)
+    return timestamp.astimezone(timezone.utc)
+
+
+def post_sample(url, topic, value, timestamp, use_msgpack=True):
+    timestamp = to_utc(timestamp)
+    if use_msgpack:
+        # epoch nanoseconds and no per-sample id keep the payload small
+        body = msgpack.packb(
+            {
+                "topic": topic,
+                "value": value,
+                "timestamp": int(timestamp.timestamp() * 1_000_000) * 1000,
+            },
+            use_bin_type=True,
+        )
+        return requests.post(
+            url, data=body, headers={"Content-Type": MSGPACK_CONTENT_TYPE}
+        )
+    data = {
+        "id": str(uuid.uuid4()),
+        "value": value,
+        "timestamp": timestamp.isoformat(),
+        "topic": topic,
+    }
+    return requests.post(url, json=data)
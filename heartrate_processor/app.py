@@ -6,6 +6,10 @@ from datetime import datetime
 import json
 
 import requests
+from sample_sender import post_sample, utc_now
+
+USE_MSGPACK = True  # send samples msgpack encoded instead of JSON
+ANALYSER_DATA_URL = "http://analysis-module:5000/data"
 
 df = pd.DataFrame(columns=["time", "heartrate"])
 
@@ -26,13 +30,7 @@ def index():
         value = int(data_split[-1])
 
         if attribute == "heartRate":
-            data = {
-                "id": str(uuid.uuid4()),
-                "value": value,
-                "timestamp": datetime.now().isoformat(),
-                "topic": "heartrate",
-            }
-            requests.post("http://analysis-module:5000/data", json=data)
+            post_sample(ANALYSER_DATA_URL, "heartrate", value, utc_now(), USE_MSGPACK)
 
     return ""
 
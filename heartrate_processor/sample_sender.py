@@ -0,0 +1 @@
+../common/sample_sender.py
\ No newline at end of file
@@ -1,4 +1,6 @@
 import json
+import threading
+import time
 import uuid
 import pyrealsense2 as rs
 import mediapipe as mp
@@ -7,6 +9,7 @@ import numpy as np
 from datetime import datetime
 import requests
 import base64
+from sample_sender import post_sample, utc_now
 
 CONSIDER_ROBOT_POSITION = True
 CAMERA_OFFSET = 600  # mm the camera is offset from the robot
@@ -17,10 +20,15 @@ REMOTE_IP = "10.2.2.173"
 ROBOT_CONTROLLER_BASE = "http://" + REMOTE_IP + ":5001"
 EXPRESSION_ANALYZER_BASE_URL = "http://" + REMOTE_IP + ":5007"
 ANALYSER_BASE_URL = "http://" + REMOTE_IP + ":5006"
+ANALYSER_DATA_URL = ANALYSER_BASE_URL + "/data"
 
 EXPRESSION_ANALYSIS_REQUEST_OFFSET = 5  # Number of frames to wait before requesting
+USE_MSGPACK = True  # send samples msgpack encoded instead of JSON
+# follow the extension on the event stream of the robot controller instead of polling it
+USE_TELEMETRY_STREAM = True
 
 has_init_operator = False
+robot_extension = None  # latest extension pushed by the robot controller
 
 
 def get_landmark_distance(results, landmark_index):
@@ -40,6 +48,26 @@ def get_arm_max_extension():
     return response.json()
 
 
+def follow_arm_max_extension():
+    global robot_extension
+    while True:
+        try:
+            with requests.get(
+                ROBOT_CONTROLLER_BASE + "/stream", stream=True, timeout=(5, 60)
+            ) as response:
+                event = None
+                for line in response.iter_lines(decode_unicode=True):
+                    if line.startswith("event: "):
+                        event = line[len("event: ") :]
+                    elif line.startswith("data: ") and event == "extension":
+                        robot_extension = json.loads(line[len("data: ") :])
+        except requests.RequestException as e:
+            print(e)
+        # poll until the stream is back
+        robot_extension = None
+        time.sleep(1)
+
+
 def img_to_base64(img):
     retval, buffer = cv2.imencode(".jpg", img)
     jpg_as_text = base64.b64encode(buffer)
@@ -57,16 +85,13 @@ def analyze_current_image_expression(image):
     if response:
         res = response.json()
         if res.get("results"):
-            emotion = res.get("results")[0].get("dominant_emotion")
+            # the probabilities of all emotions, the analysis module tallies the dominant one
+            emotion = res.get("results")[0].get("emotion")
             # print(emotion)
-            data = {
-                "id": str(uuid.uuid4()),
-                "value": emotion,
-                "timestamp": datetime.now().isoformat(),
-                "topic": "expression",
-            }
             try:
-                requests.post(ANALYSER_BASE_URL + "/data", json=data)
+                post_sample(
+                    ANALYSER_DATA_URL, "expression", emotion, utc_now(), USE_MSGPACK
+                )
             except Exception as e:
                 print(e)
 
@@ -153,6 +178,8 @@ print(f"\tConfiguration Successful for SN {device}")
 # ====== Get and process images ======
 print(f"Starting to capture images on SN: {device}")
 processed_images = 0
+if USE_TELEMETRY_STREAM:
+    threading.Thread(target=follow_arm_max_extension, daemon=True).start()
 with mp_holistic.Holistic(
     min_detection_confidence=0.5, min_tracking_confidence=0.5
 ) as holistic:
@@ -224,20 +251,22 @@ with mp_holistic.Holistic(
 
             if has_init_operator:
                 # Process distance
-                if processed_images % ROBOT_POSITION_REQUEST_OFFSET == 0:
+                if robot_extension is not None:
+                    max_extension = robot_extension
+                elif processed_images % ROBOT_POSITION_REQUEST_OFFSET == 0:
                     max_extension = get_arm_max_extension()
                     # print(max_extension)
                 distance = process_proxemics(results, max_extension)
                 print(distance)
 
-                data = {
-                    "id": str(uuid.uuid4()),
-                    "value": distance,
-                    "timestamp": datetime.now().isoformat(),
-                    "topic": "operator/distance",
-                }
                 try:
-                    requests.post(ANALYSER_BASE_URL + "/data", json=data)
+                    post_sample(
+                        ANALYSER_DATA_URL,
+                        "operator/distance",
+                        float(distance),
+                        utc_now(),
+                        USE_MSGPACK,
+                    )
                 except Exception as e:
                     print(e)
 
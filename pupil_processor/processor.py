@@ -7,6 +7,7 @@ import datetime
 import csv
 import uuid
 import pandas as pd
+from sample_sender import post_sample, utc_now
 
 EYE_INDEX_MAPPING = {
     0: "right",
@@ -14,17 +15,21 @@ EYE_INDEX_MAPPING = {
 }
 CONFIDENCE_TRHESHOLD = 0.6
 WRITE_TO_CSV = False
+USE_MSGPACK = True  # send samples msgpack encoded instead of JSON
 
 # PUPILLABS CONNECTION DETAILS
 IP = "localhost"
 PORT = 50020
 
 ANALYSER_BASE_URL = "http://localhost:5006"
+ANALYSER_DATA_URL = ANALYSER_BASE_URL + "/data"
 
 
 def approximate_timestamp(pupil_timestamp, offset):
     pupiltime_in_systemtime = pupil_timestamp + offset
-    return datetime.datetime.fromtimestamp(pupiltime_in_systemtime)
+    return datetime.datetime.fromtimestamp(
+        pupiltime_in_systemtime, datetime.timezone.utc
+    )
 
 
 def write_to_csv(data, filename="pupil.csv"):
@@ -57,17 +62,17 @@ subscriber.subscribe("blinks")
 
 
 last_pupil_data = {}
-last_blink = {"timestamp": datetime.datetime.now()}
+last_blink = {"timestamp": utc_now()}
 BLINK_OFFSET = 0.5  # seconds that must be between two blinks
 blinks = pd.DataFrame(
     columns=["value"], index=pd.DatetimeIndex(name="timestamp", data=[])
 )
-last_timestamp = datetime.datetime.now()
+last_timestamp = utc_now()
 
 
 def handle_pupils(payload):
     global last_pupil_data
-    message = msgpack.loads(payload)
+    message = msgpack.loads(payload, raw=True)
     confidence = message[b"confidence"]
 
     if confidence < CONFIDENCE_TRHESHOLD:
@@ -87,12 +92,7 @@ def handle_pupils(payload):
             }
             return
         else:
-            data = {
-                "id": str(uuid.uuid4()),
-                "value": (last_pupil_data["diameter"] + diameter) / 2,
-                "timestamp": timestamp.isoformat(),
-                "topic": "pupil",
-            }
+            value = (last_pupil_data["diameter"] + diameter) / 2
     else:
         last_pupil_data = {
             "eye": eye,
@@ -101,14 +101,21 @@ def handle_pupils(payload):
         return
 
     if WRITE_TO_CSV:
-        write_to_csv(data)
+        write_to_csv(
+            {
+                "id": str(uuid.uuid4()),
+                "value": value,
+                "timestamp": timestamp.isoformat(),
+                "topic": "pupil",
+            }
+        )
 
-    requests.post(ANALYSER_BASE_URL + "/data", json=data)
+    post_sample(ANALYSER_DATA_URL, "pupil", value, timestamp, USE_MSGPACK)
 
 
 def handle_blinks(payload):
     global blinks
-    message = msgpack.loads(payload)
+    message = msgpack.loads(payload, raw=True)
     timestamp = approximate_timestamp(message[b"timestamp"], time_offset)
     last_blink = {
         "value": 1,
@@ -136,15 +143,16 @@ def handle_blinks(payload):
                 if last_index > last_timestamp:
                     # from df get the value column from the second to last row
                     value = int(df.tail(2).head(1)["value"].values[0])
-                    data = {
-                        "id": str(uuid.uuid4()),
-                        "value": value,
-                        "timestamp": last_timestamp.isoformat(),
-                        "topic": "blinks",
-                    }
+                    sample_timestamp = last_timestamp
                     last_timestamp = last_index
                     try:
-                        requests.post(ANALYSER_BASE_URL + "/data", json=data)
+                        post_sample(
+                            ANALYSER_DATA_URL,
+                            "blinks",
+                            value,
+                            sample_timestamp,
+                            USE_MSGPACK,
+                        )
                     except Exception as e:
                         print(e)
 
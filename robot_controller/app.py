@@ -1,48 +1,191 @@
 import os
 from dotenv import load_dotenv
-from flask import Flask, request
+from flask import Flask, Response, make_response, request
 from flask_cors import CORS
-from xarm import version
-from xarm.wrapper import XArmAPI
-from robot import RobotMain
+from robot import ParamsConflict, RobotMain
+from events import EventBroker
+from executor import MotionExecutor
+from telemetry import Telemetry, round_values
 
 load_dotenv()
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=["ETag"])
 
 ROBOT_IP = os.getenv("ROBOT_IP")
-RobotMain.pprint("xArm-Python-SDK Version:{}".format(version.__version__))
-arm = XArmAPI(ROBOT_IP, baud_checkset=False)
+# run against the kinematic simulator instead of the arm, e.g. for benchmarks
+ROBOT_SIMULATOR = os.getenv("ROBOT_SIMULATOR", "false").lower() == "true"
+SIMULATOR_TIME_SCALE = float(os.getenv("SIMULATOR_TIME_SCALE", "1.0"))
+
+if ROBOT_SIMULATOR:
+    from simulator import SimulatedXArm
+
+    RobotMain.pprint("Using the simulated xArm")
+    arm = SimulatedXArm(ROBOT_IP, time_scale=SIMULATOR_TIME_SCALE)
+else:
+    from xarm import version
+    from xarm.wrapper import XArmAPI
+
+    RobotMain.pprint("xArm-Python-SDK Version:{}".format(version.__version__))
+    arm = XArmAPI(ROBOT_IP, baud_checkset=False)
 robot_main = RobotMain(arm)
+executor = MotionExecutor(robot_main)
+events = EventBroker()
+telemetry = Telemetry(events.publish)
+
+# routes that do not change the robot parameters
+NON_PARAM_ROUTES = {"/run", "/stop", "/stream"}
+
+
+def current_params():
+    with robot_main.params_lock:
+        if robot_main.is_param_init:
+            return {
+                "speed_adjustment": robot_main._speed_adjustment,
+                "current_speed": robot_main._current_speed,
+                "proxemics": robot_main._current_proxemics,
+                "rotations": robot_main._additional_rotations,
+                "smoothness": robot_main._smooth,
+                "version": robot_main.params_version,
+            }
+        params = dict.fromkeys(
+            [
+                "speed_adjustment",
+                "current_speed",
+                "proxemics",
+                "rotations",
+                "smoothness",
+            ],
+            0,
+        )
+        params["version"] = robot_main.params_version
+        return params
+
+
+def publish_params():
+    telemetry.update("params", current_params())
+    telemetry.update("extension", {"x": robot_main.get_max_x_extension()})
+
+
+def report_location(data):
+    if data.get("cartesian"):
+        x, y, z, roll, pitch, yaw = round_values(data["cartesian"][:6])
+        telemetry.update(
+            "position",
+            {"x": x, "y": y, "z": z, "roll": roll, "pitch": pitch, "yaw": yaw},
+        )
+
+
+def report_state(data=None):
+    telemetry.update(
+        "state",
+        {"state": arm.state, "error_code": arm.error_code, "warn_code": arm.warn_code},
+    )
+
+
+robot_main.on_params_changed = publish_params
+executor.on_job_changed = lambda job: events.publish("job", job.to_dict())
+# readers are served from the telemetry, only the SDK callbacks touch the arm
+arm.register_report_location_callback(report_location)
+arm.register_state_changed_callback(report_state)
+arm.register_error_warn_changed_callback(report_state)
+code, pose = arm.get_position()
+if code == 0:
+    report_location({"cartesian": pose})
+report_state()
+publish_params()
+
+
+def cached_response(name):
+    etag, _, body = telemetry.get(name)
+    if etag is None:
+        return "No telemetry received yet", 503
+    if etag in request.if_none_match:
+        response = make_response("", 304)
+    else:
+        response = make_response(body)
+        response.mimetype = "application/json"
+    response.set_etag(etag)
+    return response
+
+
+@app.after_request
+def push_param_changes(response):
+    if request.method in ("POST", "PATCH") and request.path not in NON_PARAM_ROUTES:
+        publish_params()
+    return response
+
+
+@app.route("/stream", methods=["GET"])
+def stream():
+    return Response(
+        events.stream(initial=telemetry.initial_events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @app.route("/run", methods=["POST"])
 def run_robot():
+    if not robot_main.is_param_init:
+        return "Unable to start robot because parameters have not been initialized.", 409
     iterations = request.args.get("iterations", default=1, type=int)
-    robot_main.remote_run(iterations)
-    return "Started running the robot!"
+    job = executor.submit(iterations)
+    return job.to_dict(), 202, {"Location": "/jobs/" + job.id}
+
+
+@app.route("/jobs", methods=["GET"])
+def list_jobs():
+    return {"jobs": executor.list()}
+
+
+@app.route("/jobs/<job_id>", methods=["GET", "DELETE"])
+def job(job_id):
+    if request.method == "DELETE":
+        # stops before the next waypoint, the arm finishes the commanded motion
+        job = executor.cancel(job_id)
+    else:
+        job = executor.get(job_id)
+    if job is None:
+        return "Unknown job", 404
+    return job.to_dict()
 
 
 @app.route("/stop", methods=["POST", "GET"])
 def stop_robot():
+    executor.stop_all()
     robot_main._arm.emergency_stop()
     return "Emergency stopped the robot!"
 
 
 @app.route("/position", methods=["GET"])
 def get_robot_position():
-    position = robot_main._arm.get_position()[1]
-    return {"x": position[0], "y": position[1], "z": position[2]}
+    return cached_response("position")
 
 
 @app.route("/extension", methods=["GET"])
 def get_extension():
-    return {"x": robot_main.get_max_x_extension()}
+    return cached_response("extension")
+
+
+@app.route("/state", methods=["GET"])
+def get_robot_state():
+    return cached_response("state")
+
+
+@app.route("/telemetry", methods=["GET"])
+def get_telemetry():
+    etag, sections = telemetry.snapshot()
+    if etag in request.if_none_match:
+        response = make_response("", 304)
+    else:
+        response = make_response(sections)
+    response.set_etag(etag)
+    return response
 
 
 @app.route("/episodic_behaviour", methods=["POST"])
 def episodic_behaviour():
-    robot_main._episodic_trigger = True
+    robot_main.apply_params({"episodic_behaviour": True})
     return "Will mix it up"
 
 
@@ -50,7 +193,7 @@ def episodic_behaviour():
 def speed():
     multiplier = request.args.get("multiplier", default=0, type=int)
     if multiplier >= 0 and multiplier <= 10:
-        robot_main._speed_adjustment = multiplier
+        robot_main.apply_params({"speed": {"to": multiplier}})
         return (
             "Adjusted speed from "
             + str(robot_main._current_speed)
@@ -63,23 +206,28 @@ def speed():
 
 @app.route("/increase_speed", methods=["POST"])
 def increase_speed():
-    current = robot_main._speed_adjustment
-    robot_main._speed_adjustment = min(current + 1, 10)
+    robot_main.apply_params({"speed": {"by": 1}})
     return "Increased speed"
 
 
 @app.route("/decrease_speed", methods=["POST"])
 def decrease_speed():
-    current = robot_main._speed_adjustment
-    robot_main._speed_adjustment = max(current - 1, 1)
+    robot_main.apply_params({"speed": {"by": -1}})
     return "Decreased speed"
 
 
+def change_proxemics(change):
+    with robot_main.params_lock:
+        old = robot_main._current_proxemics
+        robot_main.apply_params({"proxemics": change})
+        return {"old": old, "new": robot_main._current_proxemics}
+
+
 @app.route("/proxemics", methods=["POST"])
 def proxemics():
     multiplier = request.args.get("multiplier", default=0, type=int)
     if multiplier >= 1 and multiplier <= 10:
-        changes = robot_main.adjust_proxemics(multiplier)
+        changes = change_proxemics({"to": multiplier})
         return (
             "Adjusted speed from " + str(changes["old"]) + " to " + str(changes["new"])
         )
@@ -89,47 +237,41 @@ def proxemics():
 
 @app.route("/increase_proxemics", methods=["POST"])
 def increase_proxemics():
-    current = robot_main._current_proxemics
-    changes = robot_main.adjust_proxemics(min(current + 1, 10))
+    changes = change_proxemics({"by": 1})
     return "Increased speed from " + str(changes["old"]) + " to " + str(changes["new"])
 
 
 @app.route("/decrease_proxemics", methods=["POST"])
 def decrease_proxemics():
-    current = robot_main._current_proxemics
-    changes = robot_main.adjust_proxemics(max(current - 1, 1))
+    changes = change_proxemics({"by": -1})
     return "Increased speed from " + str(changes["old"]) + " to " + str(changes["new"])
 
 
 @app.route("/add_rotations", methods=["POST"])
 def add_rotations():
-    if robot_main._current_speed >= 6:
-        robot_main._smooth = False
-        robot_main._additional_rotations = True
+    applied, _ = robot_main.apply_params({"rotations": True})
+    if applied:
         return "Added additional rotations"
     return "Speed is too low to add additional rotations"
 
 
 @app.route("/remove_rotations", methods=["POST"])
 def remove_rotations():
-    robot_main._additional_rotations = False
+    robot_main.apply_params({"rotations": False})
     return "Removed additional rotations"
 
 
 @app.route("/add_smoothness", methods=["POST"])
 def add_smoothness():
-    if robot_main._current_speed <= 5 and not robot_main._smooth:
-        robot_main._additional_rotations = False
-        decrease_speed()
-        robot_main._smooth = True
+    applied, _ = robot_main.apply_params({"smoothness": True})
+    if applied:
         return "Added smoothness"
     return "Speed is too high to add smoothness or smoothness is already added"
 
 
 @app.route("/remove_smoothness", methods=["POST"])
 def remove_smoothness():
-    robot_main._smooth = False
-    increase_speed()
+    robot_main.apply_params({"smoothness": False})
     return "Removed smoothness"
 
 
@@ -141,26 +283,26 @@ def initialize_robot_params():
     return "There was no json in the request"
 
 
-@app.route("/params", methods=["GET"])
-def get_params():
-    if robot_main.is_param_init:
-        return {
-            "speed_adjustment": robot_main._speed_adjustment,
-            "current_speed": robot_main._current_speed,
-            "proxemics": robot_main._current_proxemics,
-            "rotations": robot_main._additional_rotations,
-            "smoothness": robot_main._smooth,
-        }
-    return dict.fromkeys(
-        [
-            "speed_adjustment",
-            "current_speed",
-            "proxemics",
-            "rotations",
-            "smoothness",
-        ],
-        0,
-    )
+@app.route("/params", methods=["GET", "PATCH"])
+def params():
+    if request.method == "GET":
+        return current_params()
+    changes = request.get_json(silent=True)
+    if not isinstance(changes, dict):
+        return "Expected the parameter changes as JSON object", 400
+    if not robot_main.is_param_init:
+        return "The parameters have not been initialized.", 409
+    changes = dict(changes)
+    version = changes.pop("version", None)
+    with robot_main.params_lock:
+        try:
+            applied, rejected = robot_main.apply_params(changes, version)
+        except ParamsConflict:
+            return {"params": current_params(), "applied": [], "rejected": []}, 409
+        except ValueError as e:
+            return str(e), 400
+        # the parameters as left by this update
+        return {"params": current_params(), "applied": applied, "rejected": rejected}
 
 
 if __name__ == "__main__":
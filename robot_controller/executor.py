@@ -0,0 +1,196 @@
+import itertools
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+CANCELLED = "cancelled"
+STOPPED = "stopped"
+FAILED = "failed"
+FINISHED = {COMPLETED, CANCELLED, STOPPED, FAILED}
+
+
+class MotionCancelled(BaseException):
+    """Raised at the next waypoint of a cancelled job.
+
+    Derived from BaseException so the ``except Exception`` blocks of the
+    movement routines do not swallow it.
+    """
+
+
+class MotionJob(object):
+    """One ``/run`` request and its progress."""
+
+    def __init__(self, job_id: str, iterations: int, on_change=None):
+        self.id = job_id
+        self.iterations = iterations
+        self.status = QUEUED
+        self.iteration = 0  # 0 while greeting
+        self.waypoint = 0  # waypoints commanded within the iteration
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self._cancelled = threading.Event()
+        self._on_change = on_change
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def _changed(self):
+        if self._on_change:
+            self._on_change(self)
+
+    def start(self):
+        self.status = RUNNING
+        self.started = time.time()
+        self._changed()
+
+    def finish(self, status: str, error: str = None):
+        self.status = status
+        self.error = error
+        self.finished = time.time()
+        self._changed()
+
+    def next_iteration(self):
+        self.iteration += 1
+        self.waypoint = 0
+        self._changed()
+
+    def check_cancelled(self):
+        if self.cancelled:
+            raise MotionCancelled()
+
+    def next_waypoint(self):
+        """Called before a waypoint is commanded, stops a cancelled job."""
+        self.check_cancelled()
+        self.waypoint += 1
+        self._changed()
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "status": self.status,
+            "iterations": self.iterations,
+            "iteration": self.iteration,
+            "waypoint": self.waypoint,
+            "cancelled": self.cancelled,
+            "error": self.error,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+        }
+
+
+class MotionExecutor(object):
+    """Runs motion jobs one after another on a dedicated thread.
+
+    Requests only enqueue a job, so they return immediately and concurrent
+    runs can never command the arm at the same time. A cancelled job stops
+    before its next waypoint and lets the arm finish the commanded motion,
+    unlike the emergency stop. The last ``history`` finished jobs are kept.
+    """
+
+    def __init__(self, robot, history: int = 100):
+        self.robot = robot
+        self.history = history
+        self.on_job_changed = None
+        self._jobs = OrderedDict()
+        self._queue = queue.Queue()
+        self._ids = itertools.count(1)
+        self._current = None
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(
+            target=self._run, name="motion-executor", daemon=True
+        )
+        self._thread.start()
+
+    def _job_changed(self, job: MotionJob):
+        if self.on_job_changed:
+            self.on_job_changed(job)
+
+    def submit(self, iterations: int) -> MotionJob:
+        with self._lock:
+            job = MotionJob(str(next(self._ids)), iterations, self._job_changed)
+            self._jobs[job.id] = job
+            self._prune()
+        self._queue.put(job)
+        self._job_changed(job)
+        return job
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.status in FINISHED]
+        for job_id in finished[: max(0, len(finished) - self.history)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id: str):
+        return self._jobs.get(job_id, None)
+
+    def list(self) -> list:
+        with self._lock:
+            return [job.to_dict() for job in self._jobs.values()]
+
+    def cancel(self, job_id: str):
+        """Cancel a job, returns the job or None if it does not exist."""
+        job = self.get(job_id)
+        if job is None:
+            return None
+        with self._lock:
+            if job.status in FINISHED:
+                return job
+            job.cancel()
+            if job.status == QUEUED:
+                job.finish(CANCELLED)
+        return job
+
+    def stop_all(self):
+        """Cancel every job, used by the emergency stop."""
+        with self._lock:
+            for job in self._jobs.values():
+                if job.status == QUEUED:
+                    job.cancel()
+                    job.finish(CANCELLED)
+            current = self._current
+            if current is not None:
+                current.cancel()
+                current.error = "Emergency stop"
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            with self._lock:
+                if job.cancelled:
+                    continue
+                self._current = job
+                job.start()
+            try:
+                self._execute(job)
+            finally:
+                with self._lock:
+                    self._current = None
+
+    def _execute(self, job: MotionJob):
+        if not self.robot.is_param_init:
+            job.finish(FAILED, "Parameters have not been initialized.")
+            return
+        try:
+            self.robot.remote_run(job.iterations, job)
+        except MotionCancelled:
+            job.finish(STOPPED if job.error else CANCELLED, job.error)
+            return
+        except Exception as e:
+            job.finish(FAILED, str(e))
+            return
+        if job.cancelled:
+            job.finish(STOPPED if job.error else CANCELLED, job.error)
+        elif not self.robot.is_alive:
+            job.finish(FAILED, "The robot stopped or reported an error.")
+        else:
+            job.finish(COMPLETED)
@@ -1,6 +1,10 @@
+import threading
 import time
 import traceback
-from robot_utils import set_position
+from collections import namedtuple
+from functools import lru_cache
+from executor import MotionCancelled
+from robot_utils import set_position, stream_segment, wait_for_motion
 from special_movements import greeting, episodic_action
 
 # Speed values
@@ -27,6 +31,57 @@ PROXEMICS_ANGLES = [
     {"angles": [0.4, 68.0, -2.3, 137.4, 2.4, -26.1, -1.9], "x_extension": 900},
 ]
 
+HOME_ANGLES = (-83.2, 24, -0.5, 66.1, -3.9, 40.3, -84.3)
+# additional waypoints before and after the proxemics waypoint
+ROTATION_ANGLES = (
+    (-19.1, -0.1, -27.3, 40.5, -125.6, 62.5, 54.3),
+    (3.9, -21, 40.5, 26, 129.7, 69.6, -50.8),
+)
+PROCEDURE_ANGLES = (
+    (42.1, 9.7, 34.2, 55.1, -11.8, 47, 80.3),
+    (26.9, -33.2, 13.9, 15.5, 7.6, 45.7, 29.9),
+    (-18.8, -26.5, -29.7, 22.1, -15.2, 44.1, -38.9),
+    HOME_ANGLES,
+)
+SMOOTH_RADIUS = 120
+
+# order in which the changes of one parameter update are applied
+PARAM_ORDER = ("speed", "proxemics", "smoothness", "rotations", "episodic_behaviour")
+
+# one move of a compiled procedure, stage is its position in the full procedure
+Segment = namedtuple("Segment", ["stage", "angles", "speed", "acc", "radius"])
+
+
+def angle_values(speed_adjustment):
+    angle_speed = MIN_ANGLE_SPEED + (speed_adjustment * ANGLE_SPEED_INCREMENT)
+    angle_speed = min([max([angle_speed, MIN_ANGLE_SPEED]), MAX_ANGLE_SPEED])
+    angle_acc = MAX_ANGLE_ACC + (speed_adjustment * ANGLE_ACC_INCREMENT)
+    angle_acc = min([max([angle_acc, MIN_ANGLE_ACC]), MAX_ANGLE_ACC])
+    return angle_speed, angle_acc
+
+
+@lru_cache(maxsize=512)
+def compile_procedure(proxemics, rotations, smooth, angle_speed, angle_acc):
+    """The moves of ``new_procedure`` for one combination of the parameters.
+
+    Smooth procedures blend all waypoints, otherwise the arm stops at each
+    of them like before.
+    """
+    stages = [HOME_ANGLES, None, None, None] + list(PROCEDURE_ANGLES)
+    stages[2] = tuple(PROXEMICS_ANGLES[proxemics - 1]["angles"])
+    if rotations:
+        stages[1], stages[3] = ROTATION_ANGLES
+    radius = SMOOTH_RADIUS if smooth else -1.0
+    return tuple(
+        Segment(stage, angles, angle_speed, angle_acc, radius)
+        for stage, angles in enumerate(stages)
+        if angles is not None
+    )
+
+
+class ParamsConflict(Exception):
+    """The parameters changed since the version the update was based on."""
+
 
 class RobotMain(object):
     """Robot Main Class"""
@@ -43,6 +98,12 @@ class RobotMain(object):
         self._speed_reactive = True
         self._current_speed = 0
         self.is_param_init = False
+        self.on_params_changed = None
+        # parameter updates and the motion loop never see half applied changes
+        self.params_lock = threading.RLock()
+        self.params_version = 0
+        self._job = None  # MotionJob of the current run, for progress and cancellation
+        self._last_target = None  # angles of the last commanded move
         self._robot_init()
 
     # Robot init
@@ -138,12 +199,101 @@ class RobotMain(object):
             return False
 
     def initialize_params(self, params: dict):
-        self._speed_adjustment = params["speed"]
-        self._current_proxemics = params["proxemics"]
-        self._additional_rotations = params["rotation"]
-        self._smooth = params["smoothness"]
-        self._episodic_trigger = False
-        self.is_param_init = True
+        with self.params_lock:
+            self._speed_adjustment = params["speed"]
+            self._current_proxemics = params["proxemics"]
+            self._additional_rotations = params["rotation"]
+            self._smooth = params["smoothness"]
+            self._episodic_trigger = False
+            self.is_param_init = True
+            self.params_version += 1
+
+    def apply_params(self, changes: dict, version: int = None):
+        """Apply several parameter changes at once.
+
+        ``speed`` and ``proxemics`` are changed ``{"by": n}`` or set
+        ``{"to": n}``, ``smoothness``, ``rotations`` and ``episodic_behaviour``
+        are switched with booleans. The changes are applied in PARAM_ORDER
+        with the constraints of the single routes. Returns the applied and the
+        rejected changes, raises ParamsConflict if ``version`` is outdated.
+        """
+        unknown = set(changes) - set(PARAM_ORDER)
+        if unknown:
+            raise ValueError("Unknown parameters: {}".format(", ".join(sorted(unknown))))
+        # validate everything first, so an invalid update changes nothing
+        for name, change in changes.items():
+            if name in ("speed", "proxemics"):
+                if (
+                    not isinstance(change, dict)
+                    or len(change) != 1
+                    or not set(change) <= {"by", "to"}
+                    or type(next(iter(change.values()))) is not int
+                ):
+                    raise ValueError(
+                        'Expected {{"by": n}} or {{"to": n}} for {}'.format(name)
+                    )
+            elif not isinstance(change, bool):
+                raise ValueError("Expected a boolean for {}".format(name))
+        with self.params_lock:
+            if version is not None and version != self.params_version:
+                raise ParamsConflict(self.params_version)
+            applied, rejected = [], []
+            for name in PARAM_ORDER:
+                if name in changes:
+                    ok = getattr(self, "_change_" + name)(changes[name])
+                    (applied if ok else rejected).append(name)
+            if applied:
+                self.params_version += 1
+            return applied, rejected
+
+    @staticmethod
+    def _target(current, change, low, high):
+        if "to" in change:
+            value = change["to"]
+            return value if low <= value <= high else None
+        by = change["by"]
+        if by >= 0:
+            return min(current + by, 10)
+        return max(current + by, 1)
+
+    def _change_speed(self, change):
+        speed = self._target(self._speed_adjustment, change, 0, 10)
+        if speed is None:
+            return False
+        self._speed_adjustment = speed
+        return True
+
+    def _change_proxemics(self, change):
+        proxemics = self._target(self._current_proxemics, change, 1, 10)
+        if proxemics is None:
+            return False
+        self.adjust_proxemics(proxemics)
+        return True
+
+    def _change_smoothness(self, smooth):
+        if smooth:
+            if self._current_speed > 5 or self._smooth:
+                return False
+            self._additional_rotations = False
+            self._change_speed({"by": -1})
+            self._smooth = True
+        else:
+            self._smooth = False
+            self._change_speed({"by": 1})
+        return True
+
+    def _change_rotations(self, rotations):
+        if rotations:
+            if self._current_speed < 6:
+                return False
+            self._smooth = False
+        self._additional_rotations = bool(rotations)
+        return True
+
+    def _change_episodic_behaviour(self, trigger):
+        if trigger:
+            self._episodic_trigger = True
+        return True
 
     def get_max_x_extension(self):
         if hasattr(self, "_current_proxemics"):
@@ -157,15 +307,15 @@ class RobotMain(object):
             self._angle_acc = angle_acc
 
     def adjust_speed(self):
-        if self._current_speed != self._speed_adjustment:
-            angle_speed = MIN_ANGLE_SPEED + (
-                self._speed_adjustment * ANGLE_SPEED_INCREMENT
-            )
-            angle_speed = min([max([angle_speed, MIN_ANGLE_SPEED]), MAX_ANGLE_SPEED])
-            angle_acc = MAX_ANGLE_ACC + (self._speed_adjustment * ANGLE_ACC_INCREMENT)
-            angle_acc = min([max([angle_acc, MIN_ANGLE_ACC]), MAX_ANGLE_ACC])
+        with self.params_lock:
+            if self._current_speed == self._speed_adjustment:
+                return
+            angle_speed, angle_acc = angle_values(self._speed_adjustment)
             self.set_angle_values(angle_speed, angle_acc)
             self._current_speed = self._speed_adjustment
+            self.params_version += 1
+            if self.on_params_changed:
+                self.on_params_changed()
 
     def adjust_proxemics(self, new_proxemics):
         if self._current_proxemics == new_proxemics:
@@ -181,51 +331,68 @@ class RobotMain(object):
         set_position(self, [2.1, -79.5, -6.5, -3.1, -7.3, 74.6, 1.9])
         set_position(self, [-83.2, 24.0, -0.5, 66.1, -3.9, 40.3, -84.3])
 
-    def new_procedure(self):
-        set_position(self, [-83.2, 24, -0.5, 66.1, -3.9, 40.3, -84.3])
-
-        if self._additional_rotations:
-            # additional waypoint for rotation
-            set_position(
-                self, [-19.1, -0.1, -27.3, 40.5, -125.6, 62.5, 54.3], wait=False
+    def procedure_key(self):
+        with self.params_lock:
+            if self._speed_reactive:
+                self.adjust_speed()
+            return (
+                self._current_proxemics,
+                bool(self._additional_rotations),
+                bool(self._smooth),
+                self._angle_speed,
+                self._angle_acc,
             )
 
-        set_position(self, PROXEMICS_ANGLES[self._current_proxemics - 1]["angles"])
-
-        if self._additional_rotations:
-            # additional waypoint for rotation
-            set_position(self, [3.9, -21, 40.5, 26, 129.7, 69.6, -50.8], wait=False)
-
-        set_position(self, [42.1, 9.7, 34.2, 55.1, -11.8, 47, 80.3])
-        set_position(self, [26.9, -33.2, 13.9, 15.5, 7.6, 45.7, 29.9])
-        set_position(self, [-18.8, -26.5, -29.7, 22.1, -15.2, 44.1, -38.9])
-        set_position(self, [-83.2, 24, -0.5, 66.1, -3.9, 40.3, -84.3])
+    def new_procedure(self):
+        # the moves are queued ahead, parameter changes apply from the next unsent one
+        stage = -1
+        while True:
+            trajectory = compile_procedure(*self.procedure_key())
+            segment = next((s for s in trajectory if s.stage > stage), None)
+            if segment is None:
+                return
+            if stream_segment(self, segment) != 0:
+                return
+            stage = segment.stage
 
     def run_iteration(self, repeat=1):
         for i in range(int(repeat)):
             if not self.is_alive:
                 break
 
+            if self._job is not None:
+                self._job.next_iteration()
             self.new_procedure()
 
             if self._episodic_trigger:
+                # the gripper commands are not queued, the procedure has to finish first
+                wait_for_motion(self)
                 angle_speed, angle_acc = self._angle_speed, self._angle_acc
-                episodic_action(self)
-                self._episodic_trigger = False
-                self.set_angle_values(angle_speed, angle_acc)
+                try:
+                    episodic_action(self)
+                finally:
+                    self._episodic_trigger = False
+                    self.set_angle_values(angle_speed, angle_acc)
 
     # Robot Main Run
-    def remote_run(self, repeat):
+    def remote_run(self, repeat, job=None):
         if not self.is_param_init:
             return "Unable to start robot because parameters have not been initialized."
+        self._job = job
+        self._last_target = None
         try:
+            # moves a cancelled job left queued finish before the gripper is used
+            wait_for_motion(self)
             greeting(self)
             # run x iterations
             self.run_iteration(repeat)
+            wait_for_motion(self)
 
+        except MotionCancelled:
+            self.pprint("Run cancelled")
+            raise
         except Exception as e:
             self.pprint("MainException: {}".format(e))
-        self._arm.release_error_warn_changed_callback(self._error_warn_changed_callback)
-        self._arm.release_state_changed_callback(self._state_changed_callback)
-        if hasattr(self._arm, "release_count_changed_callback"):
-            self._arm.release_count_changed_callback(self._count_changed_callback)
+        finally:
+            # the callbacks registered in _robot_init stay for the following jobs
+            self._job = None
@@ -1,6 +1,16 @@
+import time
+
+# moves kept queued in the arm while streaming a procedure
+TRAJECTORY_LOOKAHEAD = 2
+MOTION_POLL_INTERVAL = 0.01
+
+
 def set_position(robot, angle, wait=True):
+    if robot._job is not None:
+        robot._job.next_waypoint()
     if robot._speed_reactive:
         robot.adjust_speed()
+    robot._last_target = tuple(angle)
     return robot._arm.set_servo_angle(
         angle=angle,
         speed=robot._angle_speed,
@@ -11,6 +21,44 @@ def set_position(robot, angle, wait=True):
 
 
 def set_gripper(robot, value, speed):
+    if robot._job is not None:
+        robot._job.check_cancelled()
     return robot._arm.set_gripper_position(
         value, wait=True, speed=speed, auto_enable=True
     )
+
+
+def _wait_for_queue(robot, length):
+    while robot.is_alive:
+        if robot._job is not None:
+            # a job cancelled while waiting must not queue another move
+            robot._job.check_cancelled()
+        code, queued = robot._arm.get_cmdnum()
+        if code != 0 or queued <= length:
+            return
+        time.sleep(MOTION_POLL_INTERVAL)
+
+
+def stream_segment(robot, segment):
+    """Queue one move of a compiled procedure once the arm has room for it."""
+    if robot._job is not None:
+        robot._job.next_waypoint()
+    if segment.angles == robot._last_target:
+        # e.g. the home position ending one iteration and starting the next
+        return 0
+    _wait_for_queue(robot, TRAJECTORY_LOOKAHEAD - 1)
+    robot._last_target = segment.angles
+    code = robot._arm.set_servo_angle(
+        angle=list(segment.angles),
+        speed=segment.speed,
+        mvacc=segment.acc,
+        wait=False,
+        radius=segment.radius,
+    )
+    if code != 0:
+        robot._check_code(code, "set_servo_angle")
+    return code
+
+
+def wait_for_motion(robot):
+    _wait_for_queue(robot, 0)
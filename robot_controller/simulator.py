@@ -0,0 +1,402 @@
+import math
+import threading
+import time
+from collections import deque
+
+# xArm7 kinematics (modified DH: a, d, alpha in mm and degrees)
+XARM7_DH = [
+    (0.0, 267.0, 0.0),
+    (0.0, 0.0, -90.0),
+    (0.0, 293.0, 90.0),
+    (52.5, 0.0, 90.0),
+    (77.5, 342.5, 90.0),
+    (0.0, 0.0, 90.0),
+    (76.0, 97.0, -90.0),
+]
+# length of the xArm gripper, the TCP the x extensions of the proxemics refer to
+GRIPPER_TCP_OFFSET = 172.0
+GRIPPER_RANGE = (-10, 850)
+# seconds per gripper unit at speed 1, a full stroke takes about a second at 5000
+GRIPPER_TIME_FACTOR = 7.5
+
+# states and return codes as reported by the xArm SDK
+STATE_MOVING = 1
+STATE_IDLE = 2
+STATE_STOPPED = 4
+CODE_NOT_READY = -2
+CODE_EMERGENCY = -9
+
+DEFAULT_ANGLE_SPEED = 20.0
+DEFAULT_ANGLE_ACC = 500.0
+# seconds between two location reports, like the normal report port of the arm
+REPORT_INTERVAL = 0.1
+
+
+def forward_kinematics(angles: list, tcp_offset: float = GRIPPER_TCP_OFFSET) -> list:
+    """TCP pose [x, y, z, roll, pitch, yaw] of the xArm7 in mm and degrees."""
+    transform = [[1.0, 0.0, 0.0, 0.0], [0.0, 1.0, 0.0, 0.0], [0.0, 0.0, 1.0, 0.0]]
+    for (a, d, alpha), theta in zip(XARM7_DH, angles):
+        ca, sa = math.cos(math.radians(alpha)), math.sin(math.radians(alpha))
+        ct, st = math.cos(math.radians(theta)), math.sin(math.radians(theta))
+        link = [
+            [ct, -st, 0.0, a],
+            [st * ca, ct * ca, -sa, -sa * d],
+            [st * sa, ct * sa, ca, ca * d],
+        ]
+        transform = [
+            [
+                sum(row[k] * link[k][j] for k in range(3)) + (row[3] if j == 3 else 0.0)
+                for j in range(4)
+            ]
+            for row in transform
+        ]
+    x, y, z = (row[3] + row[2] * tcp_offset for row in transform)
+    roll = math.atan2(transform[2][1], transform[2][2])
+    pitch = math.asin(max(-1.0, min(1.0, -transform[2][0])))
+    yaw = math.atan2(transform[1][0], transform[0][0])
+    return [x, y, z] + [math.degrees(angle) for angle in (roll, pitch, yaw)]
+
+
+def move_duration(distance: float, speed: float, acc: float) -> float:
+    """Duration of a trapezoidal (or triangular) velocity profile."""
+    if distance <= 0:
+        return 0.0
+    if distance >= speed * speed / acc:
+        return distance / speed + speed / acc
+    return 2 * math.sqrt(distance / acc)
+
+
+def move_progress(elapsed: float, distance: float, speed: float, acc: float) -> float:
+    """Travelled fraction of a trapezoidal move after ``elapsed`` seconds."""
+    duration = move_duration(distance, speed, acc)
+    if distance <= 0 or elapsed >= duration:
+        return 1.0
+    ramp = min(speed / acc, duration / 2)
+    top = acc * ramp
+    if elapsed < ramp:
+        travelled = 0.5 * acc * elapsed * elapsed
+    elif elapsed < duration - ramp:
+        travelled = 0.5 * acc * ramp * ramp + top * (elapsed - ramp)
+    else:
+        left = duration - elapsed
+        travelled = distance - 0.5 * acc * left * left
+    return travelled / distance
+
+
+class _Move(object):
+    def __init__(self, target: list, speed: float, acc: float, blend: bool):
+        self.target = target
+        self.speed = speed
+        self.acc = acc
+        self.blend = blend
+        self.start = None
+        self.origin = None
+        self.distance = 0.0
+        self.duration = 0.0
+        self.scale = 1.0  # profile time per wall clock second
+
+
+class SimulatedXArm(object):
+    """Kinematic stand-in for the subset of ``XArmAPI`` the controller uses.
+
+    Joint moves are queued like in the controller of the arm and executed by
+    a background thread with a synchronised trapezoidal profile, limited by
+    the joint with the largest travel. A move with ``radius >= 0`` is blended
+    into the next queued one, which saves the deceleration and acceleration
+    at the waypoint. ``time_scale`` > 1 runs the motions faster than real time.
+    """
+
+    def __init__(self, port=None, time_scale: float = 1.0, **kwargs):
+        self.port = port
+        self.time_scale = time_scale
+        self.connected = True
+        self.mode = 0
+        self.state = STATE_STOPPED
+        self.error_code = 0
+        self.warn_code = 0
+        self.motion_enabled = False
+        self.moves_executed = 0
+        self._angles = [0.0] * 7
+        self._gripper = 0.0
+        self._speed = DEFAULT_ANGLE_SPEED
+        self._acc = DEFAULT_ANGLE_ACC
+        self._queue = deque()
+        self._current = None
+        self._state_callbacks = []
+        self._error_callbacks = []
+        self._count_callbacks = []
+        self._location_callbacks = []
+        self._reporter = None
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(
+            target=self._run, name="simulated-xarm", daemon=True
+        )
+        self._thread.start()
+
+    # callbacks
+
+    def register_state_changed_callback(self, callback):
+        self._state_callbacks.append(callback)
+        return True
+
+    def release_state_changed_callback(self, callback=None):
+        self._release(self._state_callbacks, callback)
+        return True
+
+    def register_error_warn_changed_callback(self, callback):
+        self._error_callbacks.append(callback)
+        return True
+
+    def release_error_warn_changed_callback(self, callback=None):
+        self._release(self._error_callbacks, callback)
+        return True
+
+    def register_count_changed_callback(self, callback):
+        # the counter is only changed by programs, which are not simulated
+        self._count_callbacks.append(callback)
+        return True
+
+    def release_count_changed_callback(self, callback=None):
+        self._release(self._count_callbacks, callback)
+        return True
+
+    def register_report_location_callback(
+        self, callback, report_cartesian=True, report_joints=True
+    ):
+        self._location_callbacks.append((callback, report_cartesian, report_joints))
+        if self._reporter is None:
+            self._reporter = threading.Thread(
+                target=self._report, name="simulated-xarm-report", daemon=True
+            )
+            self._reporter.start()
+        return True
+
+    def release_report_location_callback(self, callback=None):
+        self._location_callbacks[:] = [
+            entry
+            for entry in self._location_callbacks
+            if callback is not None and entry[0] != callback
+        ]
+        return True
+
+    def _report(self):
+        while self.connected:
+            time.sleep(REPORT_INTERVAL)
+            callbacks = list(self._location_callbacks)
+            if not callbacks:
+                continue
+            angles = self.angles
+            position = forward_kinematics(angles)
+            for callback, report_cartesian, report_joints in callbacks:
+                data = {}
+                if report_cartesian:
+                    data["cartesian"] = position
+                if report_joints:
+                    data["joints"] = angles
+                callback(data)
+
+    @staticmethod
+    def _release(callbacks: list, callback):
+        if callback is None:
+            callbacks.clear()
+        elif callback in callbacks:
+            callbacks.remove(callback)
+
+    def _set_state(self, state: int):
+        # called with the condition held
+        if state == self.state:
+            return
+        self.state = state
+        self._condition.notify_all()
+        for callback in list(self._state_callbacks):
+            callback({"state": state})
+
+    # state and errors
+
+    def clean_warn(self):
+        self.warn_code = 0
+        return 0
+
+    def clean_error(self):
+        self.error_code = 0
+        return 0
+
+    def motion_enable(self, enable=True, servo_id=None):
+        self.motion_enabled = bool(enable)
+        return 0
+
+    def set_mode(self, mode=0):
+        self.mode = mode
+        return 0
+
+    def set_state(self, state=0):
+        with self._condition:
+            if state == 0:
+                if not self.motion_enabled or self.error_code != 0:
+                    return CODE_NOT_READY
+                self._set_state(STATE_MOVING if self._current else STATE_IDLE)
+            elif state == STATE_STOPPED:
+                self._stop()
+            else:
+                self._set_state(state)
+        return 0
+
+    def get_state(self):
+        return 0, self.state
+
+    def get_err_warn_code(self, show=False, lang="en"):
+        return 0, [self.error_code, self.warn_code]
+
+    def emergency_stop(self):
+        with self._condition:
+            self._stop()
+        return 0
+
+    def _stop(self):
+        if self._current is not None:
+            self._angles = self._interpolate(self._current, time.monotonic())
+            self._current = None
+        self._queue.clear()
+        self._set_state(STATE_STOPPED)
+
+    def disconnect(self):
+        with self._condition:
+            self._stop()
+            self.connected = False
+
+    # motion
+
+    def set_servo_angle(
+        self,
+        servo_id=None,
+        angle=None,
+        speed=None,
+        mvacc=None,
+        mvtime=None,
+        relative=False,
+        is_radian=False,
+        wait=False,
+        timeout=None,
+        radius=None,
+        **kwargs
+    ):
+        if angle is None:
+            return 0
+        angle = [math.degrees(a) if is_radian else float(a) for a in angle]
+        with self._condition:
+            if self.state == STATE_STOPPED or not self.connected:
+                return CODE_NOT_READY
+            if speed is not None:
+                self._speed = math.degrees(speed) if is_radian else float(speed)
+            if mvacc is not None:
+                self._acc = math.degrees(mvacc) if is_radian else float(mvacc)
+            if relative:
+                base = self._queue[-1].target if self._queue else self.angles
+                angle = [b + a for b, a in zip(base, angle)]
+            blend = radius is not None and radius >= 0
+            self._queue.append(_Move(angle, self._speed, self._acc, blend))
+            self._condition.notify_all()
+        if wait:
+            return self._wait_idle(timeout)
+        return 0
+
+    def _wait_idle(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while self._queue or self._current is not None:
+                if self.state == STATE_STOPPED:
+                    return CODE_EMERGENCY
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            return CODE_EMERGENCY if self.state == STATE_STOPPED else 0
+
+    def get_cmdnum(self):
+        """Number of queued moves, including the one being executed."""
+        with self._condition:
+            return 0, len(self._queue) + (1 if self._current else 0)
+
+    def set_gripper_position(
+        self, pos, wait=False, speed=None, auto_enable=False, timeout=None, **kwargs
+    ):
+        pos = min(max(float(pos), GRIPPER_RANGE[0]), GRIPPER_RANGE[1])
+        # the gripper moves independently of the joint queue
+        duration = GRIPPER_TIME_FACTOR * abs(pos - self._gripper) / (speed or 5000)
+        self._gripper = pos
+        if wait:
+            time.sleep(duration / self.time_scale)
+        return 0
+
+    def get_gripper_position(self):
+        return 0, self._gripper
+
+    @property
+    def angles(self) -> list:
+        with self._condition:
+            if self._current is not None:
+                return self._interpolate(self._current, time.monotonic())
+            return list(self._angles)
+
+    @property
+    def position(self) -> list:
+        return forward_kinematics(self.angles)
+
+    def get_servo_angle(self, servo_id=None, is_radian=False):
+        angles = self.angles
+        if is_radian:
+            angles = [math.radians(a) for a in angles]
+        if servo_id is not None and 1 <= servo_id <= len(angles):
+            return 0, angles[servo_id - 1]
+        return 0, angles
+
+    def get_position(self, is_radian=False):
+        position = self.position
+        if is_radian:
+            position = position[:3] + [math.radians(a) for a in position[3:]]
+        return 0, position
+
+    def _interpolate(self, move: _Move, now: float) -> list:
+        elapsed = (now - move.start) * self.time_scale * move.scale
+        fraction = move_progress(elapsed, move.distance, move.speed, move.acc)
+        return [o + (t - o) * fraction for o, t in zip(move.origin, move.target)]
+
+    def _begin(self, move: _Move, blended_in: bool):
+        move.origin = list(self._angles)
+        move.distance = max(abs(t - o) for o, t in zip(move.origin, move.target))
+        full = move_duration(move.distance, move.speed, move.acc)
+        # blended waypoints are passed without stopping
+        saved = 0.0
+        ramp = min(move.speed / move.acc, full / 2) / 2
+        if blended_in:
+            saved += ramp
+        if move.blend and self._queue:
+            saved += ramp
+        move.duration = (full - saved) / self.time_scale
+        move.scale = full / (full - saved) if full > saved else 1.0
+        move.start = time.monotonic()
+        self._current = move
+
+    def _run(self):
+        blended_in = False
+        with self._condition:
+            while True:
+                while not self._queue or self.state == STATE_STOPPED:
+                    blended_in = False
+                    self._condition.wait()
+                move = self._queue.popleft()
+                self._begin(move, blended_in)
+                self._set_state(STATE_MOVING)
+                end = move.start + move.duration
+                while self._current is move and time.monotonic() < end:
+                    self._condition.wait(end - time.monotonic())
+                if self._current is not move:
+                    # emergency stop
+                    continue
+                self._angles = list(move.target)
+                self._current = None
+                self.moves_executed += 1
+                blended_in = move.blend and bool(self._queue)
+                if not self._queue:
+                    self._set_state(STATE_IDLE)
+                self._condition.notify_all()
@@ -0,0 +1,59 @@
+import json
+import threading
+import time
+
+
+class Telemetry(object):
+    """Latest robot state for readers that must not touch the arm connection.
+
+    Sections like ``position``, ``state`` or ``extension`` are updated from
+    the report callbacks of the SDK and from parameter changes. A section
+    only changes if its value does; every change bumps its version, which
+    is used as ETag, and is handed to ``publish`` as event. The JSON body is
+    serialised once per change, so serving a section costs a dict lookup.
+    """
+
+    def __init__(self, publish=None):
+        self.publish = publish
+        # versions restart with the process, the boot time keeps old ETags from matching
+        self._boot = format(int(time.time()), "x")
+        self._sections = {}  # name -> (version, value, JSON body)
+        self._lock = threading.Lock()
+
+    def update(self, name: str, value) -> bool:
+        with self._lock:
+            version, current, _ = self._sections.get(name, (0, None, None))
+            if value == current:
+                return False
+            self._sections[name] = (version + 1, value, json.dumps(value))
+            # published under the lock, so subscribers see the changes in order
+            if self.publish:
+                self.publish(name, value)
+        return True
+
+    def _etag(self, name: str, version: int) -> str:
+        return "{}-{}-{}".format(name, self._boot, version)
+
+    def get(self, name: str):
+        """ETag, value and JSON body of a section, None for all if it is unknown."""
+        version, value, body = self._sections.get(name, (0, None, None))
+        if not version:
+            return None, None, None
+        return self._etag(name, version), value, body
+
+    def snapshot(self):
+        """ETag and values of all sections."""
+        sections = dict(self._sections)
+        etag = "-".join(
+            [self._boot] + ["{}{}".format(name, sections[name][0]) for name in sorted(sections)]
+        )
+        return etag, {name: value for name, (_, value, _) in sections.items()}
+
+    def initial_events(self) -> list:
+        """(name, value) of all sections, sent to new stream subscribers."""
+        return [(name, value) for name, (_, value, _) in self._sections.items()]
+
+
+def round_values(values, digits: int = 1) -> list:
+    # reports jitter in the last digits, which should not count as a change
+    return [round(float(value), digits) for value in values]
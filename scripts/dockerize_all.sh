@@ -8,7 +8,7 @@ docker buildx build -t expression_processor .
 
 cd ../heartrate_processor
 echo "Building heartrate_processor"
-docker buildx build -t heartrate_processor .
+docker buildx build --build-context common=../common -t heartrate_processor .
 
 cd ../linkedin_scraping
 echo "Building linkedin_scraping"